@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bookingbot.records import Booking
+from bookingbot.settings import Settings
+from bookingbot.store import Store
+from bookingbot.timeslots import Timeslots
+from bookingbot.timmie import Timmie
+
+# Benchmarks for Timeslots, Timmie, Settings and Store against real files in a temporary data directory
+#
+#   python benchmarks/datalayer.py --scale 10000 --scale 100000 --output results.json
+#   python benchmarks/datalayer.py --scale 10000 --compare results.json
+#
+# Every benchmark reports the time per operation in microseconds, the best and the median of the repeats.
+# With --compare the results are checked against an earlier run, a benchmark that got slower than the tolerance
+# allows is a regression and makes the script exit with status 1.
+
+TIMEZONES = ["Europe/Amsterdam", "America/New_York", "Asia/Tokyo", "Australia/Sydney", "UTC"]
+TERRITORIES = ["NL", "US", "AU", "GB", "DE", "CA", "IE"]
+
+
+def generate_timeslots(count: int, instructors: int, booked: float, rng: random.Random):
+    start = time.time() + 3600
+    timeslots = []
+    for number in range(count):
+        timeslot = {"id": f"s{number}", "time": start + rng.randrange(60 * 24 * 60) * 60, "instructor": rng.randrange(instructors)}
+        if rng.random() < booked:
+            timeslot["booking"] = {"user_id": 1_000_000 + number, "meta_username": "meta", "got_username": "got"}
+        timeslots.append(timeslot)
+    return timeslots
+
+
+def generate_timmies(count: int, instructors: int, per_timmie: int, rng: random.Random):
+    return {str(2_000_000 + number): rng.sample(range(instructors), min(per_timmie, instructors)) for number in range(count)}
+
+
+def generate_settings(count: int, rng: random.Random):
+    return {str(3_000_000 + number): {"timezone": rng.choice(TIMEZONES), "locale": rng.choice(TERRITORIES)} for number in range(count)}
+
+
+def measure(function, number: int, repeat: int, setup=None):
+    # Time `number` calls of function, `repeat` times, returns the per-operation times in microseconds
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number * 1_000_000)
+    return {"best_us": min(timings), "median_us": statistics.median(timings), "number": number, "repeat": repeat}
+
+
+def write_json(file: str, data):
+    with open(file, "w") as jsonfile:
+        json.dump(data, jsonfile)
+
+
+def run_scale(scale: int, args, rng: random.Random):
+    instructors = max(1, scale // 100)
+    results = {}
+
+    write_json("data/timeslots.json", generate_timeslots(scale, instructors, args.booked, rng))
+    write_json("data/timmie.json", generate_timmies(max(1, scale // 10), instructors, 3, rng))
+    write_json("data/settings.json", generate_settings(scale, rng))
+    results["file.timeslots_bytes"] = os.path.getsize("data/timeslots.json")
+    results["file.settings_bytes"] = os.path.getsize("data/settings.json")
+
+    results["store.load_timeslots"] = measure(lambda: Store[list]("data/timeslots.json", [], key="id"), 1, args.repeat)
+    results["store.load_settings"] = measure(lambda: Store[dict]("data/settings.json", {}), 1, args.repeat)
+
+    settings_store = Store[dict]("data/settings.json", {})
+    user_ids = list(settings_store.data)
+    results["store.sync_settings_full"] = measure(lambda: settings_store.sync(), 1, args.repeat)
+    results["store.sync_settings_change"] = measure(
+        lambda: settings_store.sync({user_ids[0]: settings_store.data[user_ids[0]]}), args.number, args.repeat)
+    settings_store.close()
+
+    timmies = Timmie()
+    timeslots = None
+
+    def load_timeslots():
+        nonlocal timeslots
+        timeslots = Timeslots(timmies)
+    results["timeslots.load"] = measure(load_timeslots, 1, args.repeat)
+
+    booked_users = [timeslot.booking.user_id for timeslot in timeslots.list() if timeslot.booking] or [0]
+    results["timeslots.has_booking"] = measure(lambda: timeslots.has_booking(rng.choice(booked_users)), args.number, args.repeat)
+    results["timeslots.has_booking_miss"] = measure(lambda: timeslots.has_booking(-1), args.number, args.repeat)
+
+    timmie_ids = list(timmies.timmies.data)
+    results["timeslots.list_unbooked_for_timmie"] = measure(
+        lambda: timeslots.list_unbooked_for_timmie(rng.choice(timmie_ids)), args.number, args.repeat)
+    results["timeslots.available_next_5"] = measure(
+        lambda: list(timeslots.available(rng.choice(timmie_ids), limit=5)), args.number, args.repeat)
+    results["timeslots.ids.allocate"] = measure(lambda: timeslots.ids.allocate(), args.number, args.repeat)
+    results["timmie.list_timmies"] = measure(lambda: timmies.list_timmies(rng.randrange(instructors)), args.number, args.repeat)
+
+    # Every book takes another open timeslot, so only book as many as there are open
+    open_ids = iter([timeslot.id for timeslot in timeslots.list() if not timeslot.booking])
+    bookings = iter(range(4_000_000, 5_000_000))
+    book_number = max(1, min(args.number, scale // 10) // args.repeat)
+    results["timeslots.book"] = measure(
+        lambda: timeslots.book(next(open_ids), Booking(next(bookings), "got", "meta")),
+        book_number, args.repeat)
+    timeslots.timeslots.close()
+    timmies.timmies.close()
+
+    settings = None
+    cold_users = None
+
+    def reload_settings():
+        nonlocal settings, cold_users
+        settings = Settings()
+        cold_users = iter(rng.sample(user_ids, len(user_ids)))
+
+    def is_month_first_cold():
+        # Cold means nothing resolved yet: a user without a profile, and the month order shared by all Settings forgotten
+        Settings.clear_territories()
+        return settings.is_month_first(next(cold_users))
+    reload_settings()
+    results["settings.is_month_first_cold"] = measure(
+        is_month_first_cold, min(args.number, len(user_ids)), args.repeat, setup=reload_settings)
+    results["settings.is_month_first_warm"] = measure(
+        lambda: settings.is_month_first(rng.choice(user_ids)), args.number, args.repeat)
+    settings.store.close()
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    # Print the change per benchmark, returns the benchmarks that got slower than the tolerance allows
+    regressions = []
+    for scale, benchmarks in results["results"].items():
+        for name, result in benchmarks.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if not isinstance(result, dict) or not isinstance(previous, dict):
+                continue
+            ratio = result["best_us"] / previous["best_us"] if previous["best_us"] else float("inf")
+            marker = ""
+            if ratio > 1 + tolerance:
+                marker = "  REGRESSION"
+                regressions.append(f"{scale}/{name}")
+            print(f"{scale:>10} {name:<40} {previous['best_us']:>12.2f}us -> {result['best_us']:>12.2f}us  x{ratio:.2f}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bookingbot data layer")
+    parser.add_argument("--scale", type=int, action="append", help="Number of timeslots and users, can be repeated (default 10000)")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--booked", type=float, default=0.2, help="Fraction of the timeslots that is booked")
+    parser.add_argument("--number", type=int, default=1000, help="Operations per repeat for the fast benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown when comparing, 0.25 is 25%%")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "storage": args.storage, "seed": args.seed},
+        "results": {},
+    }
+
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for scale in args.scale or [10000]:
+                # Every scale gets its own directory with a data directory in it, like the bot's working directory
+                os.makedirs(os.path.join(directory, str(scale), "data"))
+                os.chdir(os.path.join(directory, str(scale)))
+                Store.configure(journal=args.storage == "journal", database="data/bookingbot.db" if args.storage == "sqlite" else None)
+                print(f"Running scale {scale}", file=sys.stderr)
+                results["results"][str(scale)] = run_scale(scale, args, rng)
+                os.chdir(directory)
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        write_json(output, results)
+
+    for scale, benchmarks in results["results"].items():
+        for name, result in benchmarks.items():
+            if isinstance(result, dict):
+                print(f"{scale:>10} {name:<40} best {result['best_us']:>12.2f}us  median {result['median_us']:>12.2f}us")
+            else:
+                print(f"{scale:>10} {name:<40} {result}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
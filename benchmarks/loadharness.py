@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bookingbot.commands import Commands
+
+# Every invocation happens in the guild that keeps its data in data/
+GUILD = Commands.legacy_guild
+
+# Drives the Commands cog without a Discord connection, using stand-ins for the context, interaction and channel
+#
+#   python benchmarks/loadharness.py --users 2000 --concurrency 200
+#
+# Instructors add timeslots while timmies list their open timeslots, book them through the booking modal and use
+# the autocomplete, all as concurrent asyncio tasks. The report has the throughput, p50/p99 latency per command and
+# how long the event loop was stalled, measured by a task that expects to wake up every millisecond.
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content)
+
+    async def edit_message(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeUser):
+        self.user = user
+        self.response = FakeResponse()
+
+
+class FakeContext:
+    def __init__(self, user: FakeUser):
+        self.author = user
+        self.user = user
+        self.guild_id = GUILD
+        self.messages = []
+        self.modal = None
+
+    async def respond(self, content=None, **kwargs):
+        self.messages.append(content)
+
+    async def send_modal(self, modal):
+        self.modal = modal
+
+
+class FakeAutocompleteContext:
+    def __init__(self, value: str):
+        self.value = value
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class FakeBot:
+    def __init__(self):
+        self.channel = FakeChannel()
+
+    def get_channel(self, channel_id: int):
+        return self.channel
+
+
+class LoopMonitor:
+    # Wakes up every interval and counts how much later than requested that happened
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.stalled = 0.0
+        self.longest = 0.0
+        self.__task = None
+
+    async def __run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            late = time.perf_counter() - start - self.interval
+            if late > self.interval:
+                self.stalled += late
+                self.longest = max(self.longest, late)
+
+    def start(self):
+        self.__task = asyncio.create_task(self.__run())
+
+    def stop(self):
+        self.__task.cancel()
+
+
+class Harness:
+    def __init__(self, cog: Commands, args, rng: random.Random):
+        self.cog = cog
+        self.args = args
+        self.rng = rng
+        self.latencies = {}
+        self.instructors = [FakeUser(100_000 + number) for number in range(args.instructors)]
+        self.timmies = [FakeUser(200_000 + number) for number in range(args.users)]
+
+    async def timed(self, name: str, coroutine):
+        start = time.perf_counter()
+        await coroutine
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    def prepare(self):
+        guild = self.cog.guilds.get(GUILD)
+        for instructor in self.instructors:
+            guild.settings.set_timezone(instructor.id, "Europe/Amsterdam")
+        for timmie in self.timmies:
+            for instructor in self.rng.sample(self.instructors, min(3, len(self.instructors))):
+                guild.timmies.add(timmie.id, instructor.id)
+
+    async def add_timeslot(self, instructor: FakeUser):
+        ctx = FakeContext(instructor)
+        timeslot = f"{self.rng.randrange(24):02}:{self.rng.randrange(60):02}"
+        await self.timed("timeslot add", Commands.add.callback(self.cog, ctx, timeslot))
+
+    async def list_open(self, timmie: FakeUser):
+        await self.timed("timeslots", Commands.timeslots_open.callback(self.cog, FakeContext(timmie)))
+
+    async def book(self, timmie: FakeUser):
+        open_timeslots = self.cog.guilds.get(GUILD).timeslots.list_unbooked_for_timmie(timmie.id)
+        if not open_timeslots:
+            return
+        timeslot_id = self.rng.choice(open_timeslots).id
+
+        ctx = FakeContext(timmie)
+        await self.timed("book", Commands.book.callback(self.cog, ctx, timeslot_id))
+        if ctx.modal is None:
+            return
+
+        # The user fills in the modal
+        ctx.modal.children[0].value = f"got{timmie.id}"
+        ctx.modal.children[1].value = ""
+        await self.timed("book modal", ctx.modal.callback(FakeInteraction(timmie)))
+
+    async def autocomplete(self):
+        query = "".join(self.rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(self.rng.randrange(1, 4)))
+        await self.timed("autocomplete timezone", self.cog.autocomplete_timezone(FakeAutocompleteContext(query)))
+        await self.timed("autocomplete locale", self.cog.autocomplete_locales(FakeAutocompleteContext(query)))
+
+    def invocations(self):
+        for instructor in self.instructors:
+            for _ in range(self.args.timeslots):
+                yield self.add_timeslot(instructor)
+        actions = []
+        for timmie in self.timmies:
+            actions.extend([self.list_open(timmie), self.book(timmie), self.autocomplete()])
+        self.rng.shuffle(actions)
+        yield from actions
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(coroutine):
+            async with semaphore:
+                await coroutine
+
+        monitor = LoopMonitor()
+        monitor.start()
+        self.cog.announcer.start()
+        start = time.perf_counter()
+        # Timeslots have to exist before they can be booked, so the instructors go first
+        invocations = list(self.invocations())
+        adds = len(self.instructors) * self.args.timeslots
+        await asyncio.gather(*(limited(invocation) for invocation in invocations[:adds]))
+        await asyncio.gather(*(limited(invocation) for invocation in invocations[adds:]))
+        duration = time.perf_counter() - start
+        monitor.stop()
+        # Booking announcements are batched into digests, send what is still queued
+        await self.cog.announcer.flush()
+        self.cog.announcer.stop()
+
+        for store in self.cog.guilds.get(GUILD).stores():
+            await store.flush()
+
+        return {
+            "duration_s": duration,
+            "invocations": sum(len(latencies) for latencies in self.latencies.values()),
+            "throughput_per_s": sum(len(latencies) for latencies in self.latencies.values()) / duration,
+            "loop_stalled_s": monitor.stalled,
+            "loop_longest_stall_ms": monitor.longest * 1000,
+            "announcements": len(self.cog.bot.channel.messages),
+            "commands": {name: summarize(latencies) for name, latencies in self.latencies.items()},
+        }
+
+
+def summarize(latencies: list):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+    return {"count": len(latencies), "p50_ms": percentile(0.50), "p99_ms": percentile(0.99), "max_ms": latencies[-1] * 1000}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Drive the Commands cog with fake Discord objects")
+    parser.add_argument("--users", type=int, default=1000, help="Number of timmies")
+    parser.add_argument("--instructors", type=int, default=20)
+    parser.add_argument("--timeslots", type=int, default=20, help="Timeslots added per instructor")
+    parser.add_argument("--concurrency", type=int, default=100, help="Invocations in flight at the same time")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.makedirs("data")
+        try:
+            harness = Harness(Commands(FakeBot()), args, random.Random(args.seed))
+            harness.prepare()
+            report = await harness.run()
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=4)
+
+    print(f"{report['invocations']} invocations in {report['duration_s']:.2f}s, {report['throughput_per_s']:.0f}/s")
+    print(f"Event loop stalled for {report['loop_stalled_s'] * 1000:.0f}ms, longest stall {report['loop_longest_stall_ms']:.1f}ms")
+    for name, summary in report["commands"].items():
+        print(f"{name:<24} {summary['count']:>6}  p50 {summary['p50_ms']:>8.2f}ms  p99 {summary['p99_ms']:>8.2f}ms  max {summary['max_ms']:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
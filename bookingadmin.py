@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+
+import pytz
+
+from bookingbot import Config, Store
+from bookingbot.guilds import Guild
+from bookingbot.records import Booking, Timeslot, user_id
+
+# Offline admin tool that streams timeslots, timmies and settings of a guild in and out of CSV or JSON lines
+#
+#   python bookingadmin.py export timeslots --format csv --output timeslots.csv
+#   python bookingadmin.py import timeslots timeslots.csv --guild 1234567890
+#
+# Without --guild it works on the files in data/ of the legacy guild, otherwise on data/guilds/<guild id>/.
+# Imports check every row as it's read and report all invalid rows with their line number. Nothing is written when
+# a row is invalid, unless --skip-invalid is given. The valid rows are applied as one batch with a single write.
+# Exports write row by row, the output is never built in memory.
+# The storage settings come from the same environment variables as the bot. Stop the bot first, or run both with
+# BOOKINGBOT_SHARED=1 so the bot merges what was imported. With --data a SQLite database in data/ is looked for in
+# that directory too.
+#
+# Columns, JSON lines have the same fields:
+#   timeslots: id, time, instructor, user_id, got_username, meta_username
+#              time is an ISO 8601 time with a UTC offset or a posix timestamp, a timeslot without id gets a new one,
+#              user_id and the usernames are empty for open timeslots. JSON lines may also nest them in "booking".
+#   timmies:   timmie, instructor, one row per instructor the timmie can book with
+#   settings:  user_id, timezone, locale, locale is a territory code like "NL", empty columns are left unchanged
+
+fields = {
+    "timeslots": ["id", "time", "instructor", "user_id", "got_username", "meta_username"],
+    "timmies": ["timmie", "instructor"],
+    "settings": ["user_id", "timezone", "locale"],
+}
+
+
+def read_rows(file, format: str):
+    # Yields (line number, row) as the file is read, a row is a dict of strings or JSON values
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"line {line_number}: not valid JSON, {error}")
+        if not isinstance(row, dict):
+            raise ValueError(f"line {line_number}: not a JSON object")
+        if isinstance(row.get("booking"), dict):
+            row = {**row, **row.pop("booking")}
+        yield line_number, row
+
+
+def required(row: dict, field: str):
+    value = row.get(field)
+    if value is None or str(value).strip() == "":
+        raise ValueError(f"{field} is missing")
+    return value
+
+
+def parse_id(row: dict, field: str):
+    value = required(row, field)
+    try:
+        return user_id(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} {value!r} is not a Discord ID")
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"time {value!r} is not an ISO 8601 time or posix timestamp")
+    if moment.tzinfo is None:
+        raise ValueError(f"time {value!r} needs a UTC offset")
+    return moment.timestamp()
+
+
+class TimeslotImport:
+    # Validates timeslot rows against the guild's timeslots and the rows before them
+
+    def __init__(self, guild: Guild):
+        self.timeslots = guild.timeslots
+        self.cutoff = time.time() - self.timeslots.expire_after
+        self.ids = set()
+        self.bookers = set()
+
+    def parse(self, row: dict) -> Timeslot:
+        timeslot_id = str(row.get("id") or "").strip()
+        if not timeslot_id:
+            timeslot_id = self.timeslots.ids.allocate()
+        elif timeslot_id in self.ids or self.timeslots.get(timeslot_id) is not None:
+            raise ValueError(f"timeslot {timeslot_id} already exists")
+
+        timeslot_time = parse_time(required(row, "time"))
+        if timeslot_time < self.cutoff:
+            raise ValueError(f"timeslot {timeslot_id} has already expired")
+        instructor = parse_id(row, "instructor")
+
+        booking = None
+        if str(row.get("user_id") or "").strip():
+            booking = Booking(parse_id(row, "user_id"), str(row.get("got_username") or ""), str(row.get("meta_username") or ""))
+            if booking.user_id in self.bookers or self.timeslots.has_booking(booking.user_id):
+                raise ValueError(f"user {booking.user_id} already has a booking")
+            self.bookers.add(booking.user_id)
+
+        self.ids.add(timeslot_id)
+        return Timeslot(timeslot_id, timeslot_time, instructor, booking)
+
+    def apply(self, timeslots: list):
+        # Timeslots at the same time as another timeslot of their instructor are skipped
+        return len(self.timeslots.add_many(timeslots))
+
+
+class TimmieImport:
+    def __init__(self, guild: Guild):
+        self.timmies = guild.timmies
+
+    def parse(self, row: dict):
+        return parse_id(row, "timmie"), parse_id(row, "instructor")
+
+    def apply(self, pairs: list):
+        return self.timmies.add_many(pairs)
+
+
+class SettingsImport:
+    def __init__(self, guild: Guild):
+        self.settings = guild.settings
+        self.territories = set()
+
+    def parse(self, row: dict):
+        values = {}
+        timezone = str(row.get("timezone") or "").strip()
+        if timezone:
+            if timezone not in pytz.all_timezones_set:
+                raise ValueError(f"unknown timezone {timezone!r}")
+            values["timezone"] = timezone
+
+        territory = str(row.get("locale") or "").strip()
+        if territory:
+            if territory not in self.territories:
+                # The same check as /settings locale
+                from babel import Locale
+                try:
+                    Locale("en", territory)
+                except Exception:
+                    raise ValueError(f"unknown locale {territory!r}")
+                self.territories.add(territory)
+            values["locale"] = territory
+        return parse_id(row, "user_id"), values
+
+    def apply(self, settings: list):
+        return self.settings.set_many(settings)
+
+
+importers = {"timeslots": TimeslotImport, "timmies": TimmieImport, "settings": SettingsImport}
+
+
+def import_rows(guild: Guild, kind: str, rows, skip_invalid: bool = False, dry_run: bool = False, errors=sys.stderr):
+    # Returns (rows applied, invalid rows), nothing is applied when a row is invalid unless skip_invalid
+    importer = importers[kind](guild)
+    records = []
+    invalid = 0
+    try:
+        for line_number, row in rows:
+            try:
+                records.append(importer.parse(row))
+            except ValueError as error:
+                invalid += 1
+                print(f"line {line_number}: {error}", file=errors)
+    except ValueError as error:
+        # The file itself can't be read any further, like a line that isn't JSON
+        print(error, file=errors)
+        return 0, invalid + 1
+
+    if dry_run:
+        return len(records), invalid
+    if invalid and not skip_invalid:
+        return 0, invalid
+    return importer.apply(records), invalid
+
+
+def export_rows(guild: Guild, kind: str, format: str):
+    # Yields the rows one at a time, in the form of the format
+    if kind == "timeslots":
+        for timeslot in guild.timeslots.list():
+            if format == "jsonl":
+                yield timeslot.to_json()
+                continue
+            row = {"id": timeslot.id, "time": datetime.datetime.fromtimestamp(timeslot.time, pytz.utc).isoformat(),
+                   "instructor": timeslot.instructor}
+            if timeslot.booking is not None:
+                row.update(timeslot.booking.to_json())
+            yield row
+    elif kind == "timmies":
+        for timmie_id, instructors in guild.timmies.timmies.data.items():
+            for instructor_id in instructors:
+                yield {"timmie": timmie_id, "instructor": instructor_id}
+    else:
+        for settings_user_id, settings in guild.settings.store.data.items():
+            yield {"user_id": int(settings_user_id), "timezone": settings.get("timezone") or "", "locale": settings.get("locale") or ""}
+
+
+def write_rows(rows, kind: str, format: str, file):
+    count = 0
+    if format == "csv":
+        writer = csv.DictWriter(file, fields[kind])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(row) + "\n")
+            count += 1
+    return count
+
+
+def open_file(file_name: str, mode: str, standard):
+    # "-" is stdin or stdout, which are left open
+    if file_name == "-":
+        return contextlib.nullcontext(standard)
+    return open(file_name, mode, newline="", encoding="utf-8")
+
+
+def guess_format(file_name: str):
+    return "csv" if file_name.endswith(".csv") else "jsonl"
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Bulk import and export the data of a guild")
+    parser.add_argument("--guild", type=int, help="guild ID, the legacy guild in data/ when not given")
+    parser.add_argument("--data", default="data", help="the data directory of the bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="add the rows of a file to the guild")
+    import_parser.add_argument("kind", choices=fields)
+    import_parser.add_argument("file", help="CSV or JSON lines file, - for stdin")
+    import_parser.add_argument("--format", choices=("csv", "jsonl"), help="guessed from the file name when not given")
+    import_parser.add_argument("--skip-invalid", action="store_true", help="import the valid rows when some are invalid")
+    import_parser.add_argument("--dry-run", action="store_true", help="only validate the rows")
+
+    export_parser = commands.add_parser("export", help="write the guild's data to a file")
+    export_parser.add_argument("kind", choices=fields)
+    export_parser.add_argument("--output", default="-", help="file to write, - for stdout")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"), help="guessed from the file name when not given")
+    arguments = parser.parse_args(arguments)
+
+    config = Config()
+    database = None
+    if config.storage == "sqlite":
+        database = config.database
+        path = os.path.relpath(database, "data")
+        if not path.startswith(".."):
+            database = os.path.join(arguments.data, path)
+    Store.configure(journal=config.storage == "journal", database=database, shared=config.shared, root=arguments.data)
+    directory = arguments.data if arguments.guild is None else f"{arguments.data}/guilds/{arguments.guild}"
+    guild = Guild(arguments.guild, directory)
+
+    try:
+        if arguments.command == "import":
+            format = arguments.format or guess_format(arguments.file)
+            with open_file(arguments.file, "r", sys.stdin) as file:
+                applied, invalid = import_rows(guild, arguments.kind, read_rows(file, format),
+                                               arguments.skip_invalid, arguments.dry_run)
+            if arguments.dry_run:
+                print(f"{applied} valid rows, {invalid} invalid rows", file=sys.stderr)
+                return 1 if invalid else 0
+            if invalid and not arguments.skip_invalid:
+                print(f"{invalid} invalid rows, nothing was imported", file=sys.stderr)
+                return 1
+            print(f"Imported {applied} {arguments.kind}, skipped {invalid} invalid rows", file=sys.stderr)
+            return 0
+
+        format = arguments.format or guess_format(arguments.output)
+        with open_file(arguments.output, "w", sys.stdout) as file:
+            count = write_rows(export_rows(guild, arguments.kind, format), arguments.kind, format, file)
+        print(f"Exported {count} {arguments.kind}", file=sys.stderr)
+        return 0
+    finally:
+        guild.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
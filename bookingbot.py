@@ -1,11 +1,14 @@
+from bookingbot.startup import startup
+
 import discord
 
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 
-from bookingbot import Config, Commands
+from bookingbot import Config, Commands, Store
 
+startup.mark("imports done")
 
 os.makedirs("data/logs", exist_ok=True)
 filehandler = RotatingFileHandler(filename="data/logs/bookingbot.log", mode="w", maxBytes=1024 * 50, backupCount=4)
@@ -14,8 +17,15 @@ logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(name)s - %(levelname)s:%(message)s",
                     handlers=[filehandler])
 
+config = Config()
+Store.configure(journal=config.storage == "journal",
+                database=config.database if config.storage == "sqlite" else None,
+                write_behind=config.write_behind,
+                shared=config.shared)
+
 bot = discord.Bot()
 
-bot.add_cog(Commands(bot))
+bot.add_cog(Commands(bot, metrics_interval=config.metrics_interval, guild_capacity=config.guild_capacity,
+                     lazy_startup=config.lazy_startup, reminder_offsets=config.reminder_offsets))
 
-bot.run(Config().token)
\ No newline at end of file
+bot.run(config.token)
\ No newline at end of file
@@ -1,6 +1,21 @@
-from bookingbot.store import Store
-from bookingbot.settings import Settings
-from bookingbot.timeslots import Timeslots
-from bookingbot.config import Config
-from bookingbot.bookingmodal import BookingModal
-from bookingbot.commands import Commands
\ No newline at end of file
+import importlib
+
+# The modules are imported on first use, so `from bookingbot import Store` doesn't pull in py-cord and babel
+_exports = {
+    "Store": "bookingbot.store",
+    "Settings": "bookingbot.settings",
+    "Timeslots": "bookingbot.timeslots",
+    "Config": "bookingbot.config",
+    "BookingModal": "bookingbot.bookingmodal",
+    "Commands": "bookingbot.commands",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+from bookingbot.stats import stats
+
+_log = logging.getLogger(__name__)
+
+
+class Announcer:
+    # Sends booking announcements from a single background task, so a booking never waits for Discord
+    #
+    # announce() only queues the line. The task waits `window` seconds after the first line so a rush of bookings
+    # turns into one digest message per channel. Every channel has a token bucket of `burst` messages refilled at
+    # `rate` messages per second, lines that arrive while waiting for a token are merged into the next digest.
+    # A failed send is retried after `backoff` seconds, doubling every attempt of that channel, up to `max_attempts`
+    # times. The lines stay queued meanwhile, after the last attempt only the lines of that digest are dropped.
+    # So under load there are fewer and larger messages instead of slower bookings.
+
+    def __init__(self, bot, window: float = 2.0, burst: int = 5, rate: float = 1.0, max_attempts: int = 5,
+                 backoff: float = 1.0, page_length: int = 1900):
+        self.bot = bot
+        self.window = window
+        self.burst = burst
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.page_length = page_length
+        self.__queue = asyncio.Queue()
+        # channel id -> lines waiting to be sent, in the order they were announced
+        self.__pending = {}
+        # channel id -> (tokens, when they were counted)
+        self.__buckets = {}
+        # channel id -> failed sends in a row
+        self.__attempts = {}
+        self.__task = None
+
+    def announce(self, channel_id: int, line: str):
+        self.__queue.put_nowait((channel_id, line))
+        stats.increment("announcements.queued")
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        if self.pending:
+            _log.warning(f"Dropping {self.pending} unsent announcements")
+
+    @property
+    def pending(self):
+        return self.__queue.qsize() + sum(len(lines) for lines in self.__pending.values())
+
+    async def flush(self):
+        # Send everything queued so far right away, ignoring the window and the buckets
+        self.__drain()
+        while self.__pending:
+            channel_id, lines = self.__pending.popitem()
+            for digest in self.digests(lines):
+                await self.__send(channel_id, digest)
+
+    def digests(self, lines: list):
+        # Splits the lines into as few digests as fit within the page length
+        digests = [[]]
+        length = 0
+        for line in lines:
+            if digests[-1] and length + len(line) + 1 > self.page_length:
+                digests.append([])
+                length = 0
+            digests[-1].append(line)
+            length += len(line) + 1
+        return digests
+
+    @staticmethod
+    def message(digest: list):
+        title = "Timeslot booked: \n" if len(digest) == 1 else f"Timeslots booked ({len(digest)}):\n"
+        return title + "".join(line + "\n" for line in digest)
+
+    async def __run(self):
+        while True:
+            if not self.__pending:
+                channel_id, line = await self.__queue.get()
+                self.__pending.setdefault(channel_id, []).append(line)
+            await asyncio.sleep(self.window)
+            self.__drain()
+
+            # Wait for the channel's rate limit, whatever is announced meanwhile joins the digest
+            channel_id = next(iter(self.__pending))
+            await asyncio.sleep(self.__take_token(channel_id))
+            self.__drain()
+
+            lines = self.__pending.pop(channel_id)
+            digest = self.digests(lines)[0]
+            try:
+                await self.__send(channel_id, digest)
+                self.__attempts.pop(channel_id, None)
+            except Exception:
+                attempts = self.__attempts.get(channel_id, 0) + 1
+                if attempts >= self.max_attempts:
+                    _log.exception(f"Dropping {len(digest)} announcements for channel {channel_id}")
+                    stats.increment("announcements.dropped", len(digest))
+                    self.__attempts.pop(channel_id, None)
+                else:
+                    _log.warning(f"Failed to send announcements to channel {channel_id}, attempt {attempts}", exc_info=True)
+                    self.__attempts[channel_id] = attempts
+                    self.__pending[channel_id] = lines
+                    await asyncio.sleep(min(60, self.backoff * 2 ** (attempts - 1)))
+                    continue
+
+            # Lines that didn't fit go to the back, so other channels get their turn
+            if len(digest) < len(lines):
+                self.__pending[channel_id] = lines[len(digest):]
+
+    def __drain(self):
+        while not self.__queue.empty():
+            channel_id, line = self.__queue.get_nowait()
+            self.__pending.setdefault(channel_id, []).append(line)
+
+    def __take_token(self, channel_id: int):
+        # Takes a token from the channel's bucket, returns how long to wait before it may be used
+        now = time.monotonic()
+        tokens, counted = self.__buckets.get(channel_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - counted) * self.rate) - 1
+        self.__buckets[channel_id] = (tokens, now)
+        return max(0.0, -tokens / self.rate)
+
+    async def __send(self, channel_id: int, digest: list):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            _log.warning(f"Announcement channel {channel_id} not found")
+            stats.increment("announcements.dropped", len(digest))
+            return
+        with stats.timer("announcements.send"):
+            await channel.send(self.message(digest))
+        stats.increment("announcements.sent", len(digest))
+        stats.increment("announcements.messages")
@@ -0,0 +1,112 @@
+import gzip
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Iterator
+
+from bookingbot.identifiers import IdAllocator
+from bookingbot.records import Timeslot
+from bookingbot.stats import stats
+from bookingbot.store import Store
+
+_log = logging.getLogger(__name__)
+
+
+class Archive:
+    # Append-only history of expired timeslots, so they can leave the live store without losing the bookings
+    #
+    # Timeslots are written as JSON lines to gzip segments in <directory>/archive/, every append is a separate gzip
+    # member. Once a segment is larger than `segment_size` bytes the next append starts a new one.
+    # The index maps "instructor:<id>" and "user:<id>" to the [segment, offset] of the members with their timeslots,
+    # a query only decompresses those members instead of reading the whole archive.
+    # The index also keeps the IDs archived in the last `recent_period` seconds with when that happened, so after a
+    # restart they aren't handed out to new timeslots right away.
+    # Index format: {"instructor:1234567890": [[1, 0], [1, 5821]], "user:1234567890": [[2, 0]], "recent": [["aB3dE", <posix timestamp>]]}
+
+    segment_size = 1024 * 1024
+    recent_period = IdAllocator.grace
+
+    def __init__(self, directory: str = "data"):
+        self.directory = f"{directory}/archive"
+        self.index = Store[dict](f"{self.directory}/index.json", {})
+        files = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        segments = [int(match.group(1)) for match in map(re.compile(r"segment-(\d+)\.jsonl\.gz$").match, files) if match]
+        self.__segment = max(segments, default=1)
+
+    def segment_file(self, segment: int):
+        return f"{self.directory}/segment-{segment:06}.jsonl.gz"
+
+    @stats.timed("archive.append")
+    def append(self, timeslots: list):
+        # Write the timeslots as one gzip member at the end of the current segment and index them
+        if not timeslots:
+            return
+
+        # With shared data other processes append too, the segments are written under the index's lock
+        with self.index.locked():
+            self.__append(timeslots)
+
+    def __append(self, timeslots: list):
+        os.makedirs(self.directory, exist_ok=True)
+        file = self.segment_file(self.__segment)
+        if os.path.exists(file) and os.path.getsize(file) >= self.segment_size:
+            self.__segment += 1
+            file = self.segment_file(self.__segment)
+
+        content = "".join(json.dumps(timeslot.to_json()) + "\n" for timeslot in timeslots)
+        with open(file, "ab") as segment:
+            offset = segment.tell()
+            segment.write(gzip.compress(content.encode()))
+            segment.flush()
+            os.fsync(segment.fileno())
+        stats.increment("archive.timeslots", len(timeslots))
+
+        now = time.time()
+        changes = {"recent": [entry for entry in self.index.data.get("recent", ()) if entry[1] > now - self.recent_period]}
+        changes["recent"].extend([timeslot.id, now] for timeslot in timeslots)
+        self.index.data["recent"] = changes["recent"]
+        for timeslot in timeslots:
+            keys = [f"instructor:{timeslot.instructor}"]
+            if timeslot.booking is not None:
+                keys.append(f"user:{timeslot.booking.user_id}")
+            for key in keys:
+                if key in changes:
+                    continue
+                changes[key] = self.index.data.setdefault(key, [])
+                changes[key].append([self.__segment, offset])
+        self.index.sync(changes)
+
+    def recent_ids(self):
+        # (id, archived at) of the timeslots archived in the last recent_period seconds
+        return [(identifier, archived_at) for identifier, archived_at in self.index.data.get("recent", ())]
+
+    def history(self, instructor: int = None, user_id: int = None) -> Iterator[Timeslot]:
+        # The archived timeslots of an instructor or of the user who booked them, oldest first, read as they're iterated
+        key = f"instructor:{instructor}" if instructor is not None else f"user:{user_id}"
+        for segment, offset in list(self.index.data.get(key, ())):
+            for timeslot in self.__read_member(segment, offset):
+                if (timeslot.instructor == instructor if instructor is not None else
+                        timeslot.booking is not None and timeslot.booking.user_id == user_id):
+                    yield timeslot
+
+    def __read_member(self, segment: int, offset: int) -> Iterator[Timeslot]:
+        # Decompress the single gzip member at offset, the members after it belong to other appends
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        content = []
+        try:
+            with open(self.segment_file(segment), "rb") as file:
+                file.seek(offset)
+                while not decompressor.eof:
+                    chunk = file.read(64 * 1024)
+                    if not chunk:
+                        break
+                    content.append(decompressor.decompress(chunk))
+        except (OSError, zlib.error):
+            _log.exception(f"Failed to read archive segment {segment} at {offset}")
+            return
+
+        for line in b"".join(content).decode().splitlines():
+            yield Timeslot.from_json(json.loads(line))
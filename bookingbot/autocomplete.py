@@ -0,0 +1,63 @@
+from bisect import bisect_right
+from functools import lru_cache
+import re
+
+
+class AutocompleteIndex:
+    # Search index for autocomplete options, built once so a keystroke doesn't have to walk every option
+    # Options are given as {name: value}, searching returns names and lookup maps a chosen name back to its value
+    # Names whose words start with the query come first, followed by names that only contain the query
+
+    def __init__(self, options: dict, limit: int = 25, cache_size: int = 1024):
+        self.__names = list(options)
+        self.__values = dict(options)
+        self.__limit = limit
+
+        # All normalized names joined in one string, so substring matches are found by str.find
+        normalized = [self.normalize(name) for name in self.__names]
+        self.__starts = []
+        position = 0
+        for name in normalized:
+            self.__starts.append(position)
+            position += len(name) + 1
+        self.__haystack = "\n".join(normalized)
+
+        # Every prefix of every word in a name, pointing to the names in their original order
+        self.__prefixes = {}
+        for index, name in enumerate(normalized):
+            for token in set(re.split(r"[/_\-\s(),.]+", name)):
+                for length in range(1, len(token) + 1):
+                    positions = self.__prefixes.setdefault(token[:length], [])
+                    if not positions or positions[-1] != index:
+                        positions.append(index)
+
+        self.__cached_search = lru_cache(maxsize=cache_size)(self.__search)
+
+    @staticmethod
+    def normalize(text: str):
+        return " ".join(text.lower().replace("_", " ").split())
+
+    def lookup(self, name: str):
+        return self.__values.get(name)
+
+    def search(self, query: str):
+        return list(self.__cached_search(self.normalize(query)))
+
+    def __search(self, query: str):
+        if not query:
+            return tuple(self.__names[:self.__limit])
+
+        matches = list(self.__prefixes.get(query, [])[:self.__limit])
+        if len(matches) < self.__limit:
+            seen = set(matches)
+            position = self.__haystack.find(query)
+            while position != -1 and len(matches) < self.__limit:
+                index = bisect_right(self.__starts, position) - 1
+                if index not in seen:
+                    seen.add(index)
+                    matches.append(index)
+                # Continue with the next name, one match per name is enough
+                next_start = self.__starts[index + 1] if index + 1 < len(self.__starts) else len(self.__haystack)
+                position = self.__haystack.find(query, next_start)
+
+        return tuple(self.__names[index] for index in matches)
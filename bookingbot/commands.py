@@ -1,66 +1,188 @@
+import asyncio
 import logging
 import os
-import random
 import re
 import shutil
-import string
+import time
 from typing import Union
 import uuid
-from babel import Locale
 import pytz
 import datetime
+import functools
+import itertools
 
 import discord
 
-from bookingbot import Timeslots, BookingModal
+from bookingbot import BookingModal
+from bookingbot.autocomplete import AutocompleteIndex
+from bookingbot.timeslotview import TimeslotView
 from discord import Cog, Option, Permissions, User, guild_only, slash_command
 from discord.commands import default_permissions
 
-from bookingbot.settings import Settings
-from bookingbot.timmie import Timmie
+from bookingbot import recurrence
+from bookingbot.announcements import Announcer
+from bookingbot.guilds import Guilds
+from bookingbot.records import Booking, Timeslot
+from bookingbot.reminders import Reminders
+from bookingbot.settings import Profile
+from bookingbot.startup import startup
+from bookingbot.stats import stats
+from bookingbot.store import StoreConflict
 
 _log = logging.getLogger(__name__)
 
 class Commands(Cog):
     
-    def __init__(self, bot):
-        self.settings = Settings()
-        self.timmies = Timmie()
-        self.timeslots = Timeslots(self.timmies)
+    # The guild that used the bot before it served more than one, it keeps its data in data/ and its announcement channel
+    legacy_guild = 1215223314151374849
+    legacy_announcement_channel = 1215223888854917121
+
+    def __init__(self, bot, metrics_interval: float = 0, guild_capacity: int = 100, lazy_startup: bool = False,
+                 reminder_offsets: tuple = (3600, 600)):
+        # DMs before booked timeslots start, the reminders of a guild are scheduled when it's loaded
+        self.reminders = Reminders(bot, reminder_offsets)
+        # Guild data is loaded on first use, at most guild_capacity guilds are kept in memory
+        # Guilds can load after the expiry task went to sleep, they wake it up from the thread that loaded them
+        self.expiry_wakeup = asyncio.Event()
+        self.expiry_task = None
+        self.event_loop = None
+        self.guilds = Guilds(guild_capacity, self.legacy_guild, self.legacy_announcement_channel, on_load=self.guild_loaded)
         self.bot = bot
+        # Booking announcements are sent from a background task, batched into digests when bookings come in quickly
+        self.announcer = Announcer(bot)
+        # Load the guilds the commands are registered in up front, with lazy_startup from background threads while the
+        # bot connects and the autocomplete indexes on first use
+        for guild_id in (self.guild_ids or [self.legacy_guild])[:guild_capacity]:
+            if lazy_startup:
+                self.guilds.preload(guild_id)
+            else:
+                self.guilds.get(guild_id)
+        if not lazy_startup:
+            self.timezone_index, self.territory_index
+        # Seconds between writing the metrics to data/metrics.prom, 0 to not write them
+        self.metrics_interval = metrics_interval
+        self.metrics_task = None
+        # Rendered listing line per timeslot ID, together with the timeslot fields it was rendered from
+        self.rendered_timeslots = {}
+
+    @functools.cached_property
+    def timezone_index(self):
+        return AutocompleteIndex({timezone: timezone for timezone in pytz.all_timezones})
+
+    @functools.cached_property
+    def territory_index(self):
+        from babel import Locale
+        return AutocompleteIndex({name: code for code, name in Locale("en").territories.items() if len(code) == 2})
+
+    def guild_loaded(self, guild):
+        self.reminders.schedule_guild(guild)
+        # Before on_ready there is no expiry task yet, it looks at all loaded guilds when it starts
+        if self.event_loop is not None:
+            self.event_loop.call_soon_threadsafe(self.expiry_wakeup.set)
+
+    @Cog.listener()
+    async def on_ready(self):
+        startup.mark("ready")
+        self.event_loop = asyncio.get_running_loop()
+        self.announcer.start()
+        self.reminders.start(self.guilds)
+        if self.expiry_task is None:
+            self.expiry_task = asyncio.create_task(self.expire_timeslots())
+        if self.metrics_task is None and self.metrics_interval:
+            self.metrics_task = asyncio.create_task(self.write_metrics())
+
+    async def write_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                stats.write_prometheus("data/metrics.prom")
+            except Exception:
+                _log.exception("Failed to write metrics")
+
+    async def cog_before_invoke(self, ctx: discord.ApplicationContext):
+        ctx.started = time.perf_counter()
+        # With lazy_startup the guild may still be loading in the background
+        await self.guilds.wait_for(ctx.guild_id)
+
+    async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception):
+        # With shared data another process can change the same timeslot, timmie or setting at the same time, then
+        # nothing was saved and the store has reloaded, the user can simply try again
+        if isinstance(getattr(error, "original", error), StoreConflict):
+            stats.increment("commands.conflicts", command=ctx.command.qualified_name)
+            await ctx.respond("Someone else changed this at the same time, nothing was saved. Please try again.", ephemeral=True)
+            return
+        _log.error(f"Command {ctx.command.qualified_name} failed", exc_info=error)
+
+    async def cog_after_invoke(self, ctx: discord.ApplicationContext):
+        # Called after every slash command of this cog, also when it failed
+        duration = time.perf_counter() - ctx.started
+        stats.observe("command", duration, command=ctx.command.qualified_name)
+        startup.first_command(duration)
+
+    async def expire_timeslots(self):
+        # Sleep until the next timeslot expires, or until a new timeslot might expire earlier, and evict what is due
+        while True:
+            # Only loaded guilds are checked, the listings skip expired timeslots of a guild until it's loaded again
+            next_expiry = None
+            for guild in self.guilds.loaded():
+                try:
+                    for timeslot in guild.timeslots.expire():
+                        self.rendered_timeslots.pop(timeslot.id, None)
+                except Exception:
+                    _log.exception(f"Failed to expire timeslots of guild {guild.id}")
+
+                guild_expiry = guild.timeslots.next_expiry()
+                if guild_expiry is not None and (next_expiry is None or guild_expiry < next_expiry):
+                    next_expiry = guild_expiry
+            timeout = None if next_expiry is None else max(0, next_expiry - time.time())
+            self.expiry_wakeup.clear()
+            try:
+                await asyncio.wait_for(self.expiry_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def cog_unload(self):
+        for task in (self.expiry_task, self.metrics_task):
+            if task is not None:
+                task.cancel()
+        self.announcer.stop()
+        self.reminders.stop()
+
+        # Make sure pending writes reach the disk
+        self.guilds.close()
         
-    guild_ids = [1215223314151374849]
+    # The guilds to register the commands in, comma separated, empty to register them globally for every guild
+    guild_ids = [int(guild_id) for guild_id in os.environ.get("BOOKINGBOT_GUILD_IDS", str(legacy_guild)).split(",") if guild_id.strip()] or None
         
     timeslots = discord.SlashCommandGroup(
         name="timeslot",
         description="Timeslot management",
         default_member_permissions=Permissions(administrator=True),
-        guild_ids=guild_ids)
+        guild_ids=guild_ids,
+        guild_only=True)
     
     settings = discord.SlashCommandGroup(
         name="set",
         description="User settings",
         default_member_permissions=Permissions(administrator=True),
-        guild_ids=guild_ids)
+        guild_ids=guild_ids,
+        guild_only=True)
     
     timmies = discord.SlashCommandGroup(
         name="timmie",
         description="Timmie management",
         default_member_permissions=Permissions(administrator=True),
-        guild_ids=guild_ids)
+        guild_ids=guild_ids,
+        guild_only=True)
     
+    @stats.timed("autocomplete", option="timezone")
     async def autocomplete_timezone(self, ctx: discord.AutocompleteContext):
-        return [tz for tz in pytz.all_timezones if ctx.value.lower() in tz.lower()][:25]
+        return self.timezone_index.search(ctx.value)
     
+    @stats.timed("autocomplete", option="locale")
     async def autocomplete_locales(self, ctx: discord.AutocompleteContext):
-        return [Locale("en").territories[locale] for locale in Locale("en").territories if len(locale) == 2 and ctx.value.lower() in Locale("en").territories[locale].lower()][:25]
+        return self.territory_index.search(ctx.value)
     
-    def generate_identifier(self):
-        """Generate a random 5 character identifier excluding 'o', 'O', and '0'."""
-        characters = string.ascii_letters + string.digits
-        characters = characters.replace('o', '').replace('O', '').replace('0', '')
-        return ''.join(random.choices(characters, k=5))
-
     @settings.command(name="timezone")
     async def set_timezone(
         self,
@@ -70,6 +192,7 @@ class Commands(Cog):
         ),
     ):
         """Set your timezone. Use the autocomplete to find your timezone."""
+        guild = self.guilds.get(ctx.guild_id)
         # Get the user ID
         user_id = ctx.author.id
 
@@ -77,15 +200,13 @@ class Commands(Cog):
         selected_timezone = timezone
 
         # Save the timezone for the user
-        self.settings.set_timezone(user_id, selected_timezone)
+        guild.settings.set_timezone(user_id, selected_timezone)
 
         # Send a confirmation message
         await ctx.respond(f"Your timezone has been set to {selected_timezone}.", ephemeral=True)
         
     def get_territory_code(self, name):
-        locale = Locale('en')
-        reverse_territories = {v: k for k, v in locale.territories.items()}
-        return reverse_territories.get(name)
+        return self.territory_index.lookup(name)
 
     @settings.command(name="locale")
     async def set_locale(
@@ -96,6 +217,7 @@ class Commands(Cog):
         ),
     ):
         """Set your locale. Use the autocomplete to find your locale."""
+        guild = self.guilds.get(ctx.guild_id)
         # Get the user ID
         user_id = ctx.author.id
 
@@ -103,6 +225,7 @@ class Commands(Cog):
         selected_locale = self.get_territory_code(locale)
         
         # Check if it's possible to make a locale using "en" and the selected territory code
+        from babel import Locale
         try:
             Locale("en", selected_locale)
         except Exception as e:
@@ -110,113 +233,220 @@ class Commands(Cog):
             return
 
         # Save the locale for the user
-        self.settings.set_locale(user_id, selected_locale)
+        guild.settings.set_locale(user_id, selected_locale)
 
         # Send a confirmation message
         await ctx.respond(f"Your locale has been set to {selected_locale}.", ephemeral=True)
         
     
+    @settings.command(name="channel")
+    async def set_channel(
+        self,
+        ctx: discord.ApplicationContext,
+        channel: Option(discord.TextChannel, "The channel to announce bookings in", required=True),
+    ):
+        """Set the channel where bookings in this server are announced."""
+        self.guilds.get(ctx.guild_id).set_announcement_channel(channel.id)
+        await ctx.respond(f"Bookings will be announced in <#{channel.id}>.", ephemeral=True)
+
+    def parse_timeslot(self, timeslot: str, current_time: datetime.datetime, month_first: bool):
+        # Parse the timeslot using a regex
+        # The timeslot can be in the format HH:MM or DATE HH:MM
+        # DATE format is DD/MM or MM/DD, depending on the user's locale
+        regex = r"((\d{1,2})[/-](\d{1,2}) )?(\d{1,2}):?(\d{2})"
+        date, day, month, hour, minute = re.match(regex, timeslot).groups()
+        
+        # Swap day and month if the user's locale uses the month first
+        if month_first:
+            day, month = month, day
+            
+        start_time = current_time.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+        if start_time < current_time:
+            # Add a day if the timeslot is earlier than now
+            start_time += datetime.timedelta(days=1)
+        
+        # If the date is provided, set the date and month  
+        if date:
+            start_time = start_time.replace(day=int(day), month=int(month))
+            if start_time < current_time:
+                # Add a year if the date is before today
+                start_time = start_time.replace(year=current_time.year + 1)
+        return start_time
+
+    def invalid_timeslot_message(self, profile: Profile):
+        month_format = profile.date_format
+        return (
+            f"Invalid timeslot format. Please use either `HH:MM` or `{month_format} HH:MM`. You can leave out the `:` if you want. The date can be separated by either the `/` or `-`.\n\n"+
+            f"If you want to use `MM/DD` instead of `DD/MM` make sure to use the `/set locale` command first.\n\n"+
+            f"Example for the next 24 hours: `/timeslot add 15:00` or `/timeslot add 1500`\n"+
+            f"Example for a specific date: `/timeslot add 03/02 15:00` or `/timeslot add 3-2 1500`")
+    
     @timeslots.command(name="add")
     async def add(self, ctx: discord.ApplicationContext, timeslot: str):
         """Add a timeslot. Use `HH:MM`  for today or `DATE HH:MM` for a specific date."""
+        guild = self.guilds.get(ctx.guild_id)
         # Get the user ID
         user_id = ctx.author.id
 
-        # Get the user's timezone
-        user_timezone = self.settings.get_timezone(str(user_id))
+        # Get the user's timezone and date order
+        profile = guild.settings.get_profile(user_id)
 
         # If the user has not set their timezone, send an error message
-        if not user_timezone:
+        if not profile.timezone:
             await ctx.respond("You need to set your timezone first.", ephemeral=True)
             return
 
         # Get the current time in the user's timezone
-        current_time = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(pytz.timezone(user_timezone))
+        current_time = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(profile.timezone)
         
-        # Parse the timeslot using a regex
-        # The timeslot can be in the format HH:MM or DATE HH:MM
-        # DATE format is DD/MM or MM/DD, depending on the user's locale
-        month_first = self.settings.is_month_first(user_id)
+        try:
+            start_time = self.parse_timeslot(timeslot, current_time, profile.month_first)
+        except (Exception):
+            await ctx.respond(self.invalid_timeslot_message(profile), ephemeral=True)
+            return
+
+        # Create the timeslot
+        new_timeslot = Timeslot(guild.timeslots.ids.allocate(), start_time.timestamp(), user_id)
+
+        # Add the timeslot and let the expiry task know about it
+        guild.timeslots.add(new_timeslot)
+        self.expiry_wakeup.set()
+
+        # Send a confirmation message
+        await ctx.respond(f"Timeslot added:\n" + self.render_timeslots([new_timeslot]), ephemeral=True)
         
+    # The most timeslots a single bulk command may create
+    max_bulk_timeslots = 100
+
+    @timeslots.command(name="bulk")
+    async def add_bulk(
+        self,
+        ctx: discord.ApplicationContext,
+        timeslots: Option(str, "Timeslots separated by commas, like `18:00, 20:00` or `03/02 15:00, 04/02 15:00`", required=True),
+        days: Option(str, "Repeat the times on `daily`, `weekdays`, `weekends` or days like `mon,wed`", required=False) = None,
+        weeks: Option(int, "The number of weeks to repeat for", required=False, min_value=1, max_value=8) = 1,
+    ):
+        """Add several timeslots at once, optionally repeating them on days of the week."""
+        guild = self.guilds.get(ctx.guild_id)
+        # Get the user ID
+        user_id = ctx.author.id
+
+        # Get the user's timezone and date order
+        profile = guild.settings.get_profile(user_id)
+
+        # If the user has not set their timezone, send an error message
+        if not profile.timezone:
+            await ctx.respond("You need to set your timezone first.", ephemeral=True)
+            return
+
+        # Get the current time in the user's timezone
+        current_time = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(profile.timezone)
+        entries = [entry.strip() for entry in timeslots.split(",") if entry.strip()]
+
         try:
-            regex = r"((\d{1,2})[/-](\d{1,2}) )?(\d{1,2}):?(\d{2})"
-            date, day, month, hour, minute = re.match(regex, timeslot).groups()
-            
-            # Swap day and month if the user's locale uses the month first
-            if month_first:
-                day, month = month, day
-                
-            start_time = current_time.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
-            if start_time < current_time:
-                # Add a day if the timeslot is earlier than now
-                start_time += datetime.timedelta(days=1)
-            
-            # If the date is provided, set the date and month  
-            if date:
-                start_time = start_time.replace(day=int(day), month=int(month))
-                if start_time < current_time:
-                    # Add a year if the date is before today
-                    start_time = start_time.replace(year=current_time.year + 1)
+            if days:
+                # Recurring, every entry is a time of day
+                times_of_day = []
+                for entry in entries:
+                    hour, minute = re.fullmatch(r"(\d{1,2}):?(\d{2})", entry).groups()
+                    times_of_day.append((int(hour), int(minute)))
+                start_times = recurrence.occurrences(profile.timezone, current_time, times_of_day, recurrence.parse_days(days), weeks)
+            else:
+                start_times = [self.parse_timeslot(entry, current_time, profile.month_first) for entry in entries]
+            start_times = list(itertools.islice(start_times, self.max_bulk_timeslots + 1))
         except (Exception):
-            month_format = "MM/DD" if month_first else "DD/MM"
-            
             await ctx.respond(
-                f"Invalid timeslot format. Please use either `HH:MM` or `{month_format} HH:MM`. You can leave out the `:` if you want. The date can be separated by either the `/` or `-`.\n\n"+
-                f"If you want to use `MM/DD` instead of `DD/MM` make sure to use the `/set locale` command first.\n\n"+
-                f"Example for the next 24 hours: `/timeslot add 15:00` or `/timeslot add 1500`\n"+
-                f"Example for a specific date: `/timeslot add 03/02 15:00` or `/timeslot add 3-2 1500`", 
+                self.invalid_timeslot_message(profile) + "\n\n" +
+                "Separate timeslots with a `,`. When repeating, only use times like `18:00` and days like `weekdays` or `mon,wed,fri`.",
                 ephemeral=True)
             return
 
-        # Create the timeslot dictionary
-        timeslot_dict = {
-            "id": self.generate_identifier(),
-            "time": start_time.timestamp(),
-            "instructor": user_id
-        }
+        if len(start_times) > self.max_bulk_timeslots:
+            await ctx.respond(f"That would add more than {self.max_bulk_timeslots} timeslots, please add fewer at once.", ephemeral=True)
+            return
 
-        # Add the timeslot
-        self.timeslots.add(timeslot_dict)
+        # Add all timeslots with a single write, skipping the ones you already have at that time
+        identifiers = guild.timeslots.ids.allocate(len(start_times))
+        added = guild.timeslots.add_many(
+            Timeslot(identifier, start_time.timestamp(), user_id) for identifier, start_time in zip(identifiers, start_times))
+        self.expiry_wakeup.set()
 
         # Send a confirmation message
-        await ctx.respond(f"Timeslot added:\n" + self.render_timeslots([timeslot_dict]), ephemeral=True)
-        
+        skipped = len(start_times) - len(added)
+        if not added:
+            await ctx.respond("No timeslots added, you already have all of them.", ephemeral=True)
+        elif skipped:
+            await self.respond_timeslots(ctx, added, f"Timeslots added, skipped {skipped} you already have:")
+        else:
+            await self.respond_timeslots(ctx, added, "Timeslots added:")
+
     @timeslots.command(name="list")
     async def list_timeslots(self, ctx: discord.ApplicationContext, boa: Option(User) = None):
         """Command to list all timeslots. If a user is provided, list their timeslots."""
-        # Get all timeslots
+        guild = self.guilds.get(ctx.guild_id)
+        # Get all timeslots, these are already sorted by time ascending
         if boa is not None:
-            all_timeslots = self.timeslots.list(boa.id)
+            all_timeslots = guild.timeslots.list(boa.id)
+        else:
+            all_timeslots = guild.timeslots.list()
+        # Send the timeslots, a page at a time
+        await self.respond_timeslots(ctx, all_timeslots)
+
+    @timeslots.command(name="history")
+    async def history(
+        self,
+        ctx: discord.ApplicationContext,
+        boa: Option(User, "The BOA to show past timeslots for", required=False) = None,
+        user: Option(User, "The user to show past bookings for", required=False) = None,
+    ):
+        """Show the past timeslots of a BOA (you by default), or the past bookings of a user."""
+        guild = self.guilds.get(ctx.guild_id)
+        if user is not None:
+            past_timeslots = guild.timeslots.archive.history(user_id=user.id)
         else:
-            all_timeslots = self.timeslots.list()
-        # Sort timeslots by time ascending
-        all_timeslots.sort(key=lambda x: x["time"])
+            past_timeslots = guild.timeslots.archive.history(instructor=(boa or ctx.author).id)
+        # The archive is read as the pages are shown, past timeslots don't go in the rendering cache
+        await self.respond_timeslots(ctx, past_timeslots, "Past timeslots:", functools.partial(self.render_timeslot, cache=False))
+
+    async def respond_timeslots(self, ctx: discord.ApplicationContext, timeslots, title: str = "Timeslots:", render=None):
+        view = TimeslotView(title, timeslots, render or self.render_timeslot)
         # If there are no timeslots, send a message
-        if not all_timeslots:
+        if view.empty:
             await ctx.respond("There are no timeslots available.", ephemeral=True)
             return
-        # Create a formatted message with the timeslots
-        message = "Timeslots:\n" + self.render_timeslots(all_timeslots)
-        # Send the message
-        await ctx.respond(message, ephemeral=True)
+        # Only add the page buttons when there is more than one page
+        if view.paginated:
+            await ctx.respond(view.content, view=view, ephemeral=True)
+        else:
+            await ctx.respond(view.content, ephemeral=True)
         
     def render_timeslots(self, timeslots: list):
-        message = ""
-        for timeslot in timeslots:
-            # Add the timeslot to the message with discord timestamp and instructor tag
-            message += f"- ID:`{timeslot['id']}` <t:{int(timeslot['time'])}:f> (BOA: <@{timeslot['instructor']}>)"
-            # If the timeslot is booked, add the booking information
-            if timeslot.get("booking"):
-                booking = timeslot["booking"]
-                message += f" - Booked by <@{booking['user_id']}> (GOT: `{booking['got_username']}`, Meta: `{booking['meta_username'] or 'N/A'}`, timestamp: `<t:{int(timeslot['time'])}:f>`)"
-            message += "\n"
-        return message
+        return "".join(self.render_timeslot(timeslot) + "\n" for timeslot in timeslots)
+
+    def render_timeslot(self, timeslot: Timeslot, cache: bool = True):
+        # Bookings are replaced rather than changed, so comparing the booking record is enough
+        fields = (timeslot.time, timeslot.instructor, timeslot.booking)
+        cached = self.rendered_timeslots.get(timeslot.id)
+        if cached is not None and cached[0] == fields:
+            return cached[1]
+
+        # Add the timeslot to the message with discord timestamp and instructor tag
+        line = f"- ID:`{timeslot.id}` <t:{int(timeslot.time)}:f> (BOA: <@{timeslot.instructor}>)"
+        # If the timeslot is booked, add the booking information
+        booking = timeslot.booking
+        if booking:
+            line += f" - Booked by <@{booking.user_id}> (GOT: `{booking.got_username}`, Meta: `{booking.meta_username or 'N/A'}`, timestamp: `<t:{int(timeslot.time)}:f>`)"
+        if cache:
+            self.rendered_timeslots[timeslot.id] = (fields, line)
+        return line
         
     @timeslots.command(name="remove")
     async def remove_timeslot(self, ctx: discord.ApplicationContext, timeslot_id: str):
         """Command to remove a timeslot."""
+        guild = self.guilds.get(ctx.guild_id)
         
-        self.timeslots.remove(timeslot_id)
+        guild.timeslots.remove(timeslot_id)
+        self.rendered_timeslots.pop(timeslot_id, None)
         
         # Send a confirmation message
         await ctx.respond("Timeslot removed.", ephemeral=True)
@@ -224,24 +454,27 @@ class Commands(Cog):
     @timmies.command(name="add")
     async def add_timmie(self, ctx: discord.ApplicationContext, timmie: Option(User, "The timmie to add", required=True)):
         """Add a timmie for your timeslots."""
+        guild = self.guilds.get(ctx.guild_id)
         user_id = ctx.author.id
-        self.timmies.add(timmie.id, user_id)
+        guild.timmies.add(timmie.id, user_id)
         await ctx.respond(f"Timmie <@{timmie.id}> added for <@{user_id}>.", ephemeral=True)
         
     @timmies.command(name="remove")
     async def remove_timmie(self, ctx: discord.ApplicationContext, timmie: Option(User, "The timmie to remove", required=True)):
         """Remove a timmie for your timeslots."""
+        guild = self.guilds.get(ctx.guild_id)
         user_id = ctx.author.id
-        self.timmies.remove(timmie.id, user_id)
+        guild.timmies.remove(timmie.id, user_id)
         await ctx.respond(f"Timmie <@{timmie.id}> removed for <@{user_id}>.", ephemeral=True)
         
     @timmies.command(name="list")
     async def list_timmies(self, ctx: discord.ApplicationContext, boa: Option(User, "The BOA to list timmies for", required=False) = None):
         """List all timmies. If a user is provided, list their timmies."""
+        guild = self.guilds.get(ctx.guild_id)
         if boa is not None:
-            all_timmies = self.timmies.list_timmies(boa.id)
+            all_timmies = guild.timmies.list_timmies(boa.id)
         else:
-            all_timmies = self.timmies.list_timmies(ctx.author.id)
+            all_timmies = guild.timmies.list_timmies(ctx.author.id)
         if not all_timmies:
             await ctx.respond("You don't have any timmies.", ephemeral=True)
             return
@@ -249,36 +482,71 @@ class Commands(Cog):
         await ctx.respond(message, ephemeral=True)
         
     @slash_command(name="timeslots")
-    async def timeslots_open(self, ctx: discord.ApplicationContext):
-        """List all timeslots that are open for you."""
+    @guild_only()
+    async def timeslots_open(
+        self,
+        ctx: discord.ApplicationContext,
+        count: Option(int, "Only show the first this many timeslots", required=False, min_value=1, max_value=100) = None,
+        start: Option(str, "Only show timeslots from this date or time, like `03/02` or `03/02 18:00`", required=False) = None,
+        end: Option(str, "Only show timeslots until this date or time, like `05/02` or `05/02 12:00`", required=False) = None,
+        boa: Option(User, "Only show the timeslots of this BOA", required=False) = None,
+    ):
+        """List the timeslots that are open for you, optionally only the next few, between dates or of one BOA."""
+        guild = self.guilds.get(ctx.guild_id)
         # Get the user ID
         user_id = ctx.author.id
         
         # If the user already has a booking, don't allow them to book another timeslot
         user_id = ctx.author.id
-        if self.timeslots.has_booking(user_id):
+        if guild.timeslots.has_booking(user_id):
             await ctx.respond("You already have a booking.", ephemeral=True)
             return
-        
-        # Get all timeslots
-        all_timeslots = self.timeslots.list_unbooked_for_timmie(user_id)
-        # Sort timeslots by time ascending
-        all_timeslots.sort(key=lambda x: x["time"])
-        # If there are no timeslots, send a message
-        if not all_timeslots:
-            await ctx.respond("There are no timeslots available.", ephemeral=True)
-            return
-        # Create a formatted message with the timeslots
-        message = "Timeslots:\n" + self.render_timeslots(all_timeslots)
-        # Send the message
-        await ctx.respond(message, ephemeral=True)
+
+        # Dates are in the user's timezone and date order
+        start_time = end_time = None
+        if start or end:
+            profile = guild.settings.get_profile(user_id)
+            if not profile.timezone:
+                await ctx.respond("You need to set your timezone first to look for timeslots between dates.", ephemeral=True)
+                return
+            current_time = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(profile.timezone)
+            try:
+                if start:
+                    start_time = self.parse_moment(start, current_time, profile.month_first).timestamp()
+                if end:
+                    end_time = self.parse_moment(end, current_time, profile.month_first, end_of_day=True).timestamp()
+            except (Exception):
+                await ctx.respond(self.invalid_timeslot_message(profile), ephemeral=True)
+                return
+
+        # The open timeslots sorted by time, found as the pages are shown
+        open_timeslots = guild.timeslots.available(user_id, start_time, end_time, boa.id if boa is not None else None, count)
+        # Send the timeslots, a page at a time
+        await self.respond_timeslots(ctx, open_timeslots)
+
+    def parse_moment(self, moment: str, current_time: datetime.datetime, month_first: bool, end_of_day: bool = False):
+        # A timeslot like parse_timeslot takes, or just a date which is the start of that day, or the end with end_of_day
+        date = re.fullmatch(r"(\d{1,2})[/-](\d{1,2})", moment.strip())
+        if date is None:
+            return self.parse_timeslot(moment.strip(), current_time, month_first)
+
+        day, month = (int(date.group(2)), int(date.group(1))) if month_first else (int(date.group(1)), int(date.group(2)))
+        start_of_day = current_time.tzinfo.localize(datetime.datetime(current_time.year, month, day))
+        if start_of_day.date() < current_time.date():
+            # A date before today is next year
+            start_of_day = current_time.tzinfo.localize(datetime.datetime(current_time.year + 1, month, day))
+        if end_of_day:
+            return current_time.tzinfo.localize(datetime.datetime.combine(start_of_day.date() + datetime.timedelta(days=1), datetime.time()))
+        return start_of_day
         
     @slash_command()
+    @guild_only()
     async def book(self, ctx: discord.ApplicationContext, timeslot_id: str = None):
         """Book a timeslot. If no timeslot ID is provided, list all available timeslots."""
+        guild = self.guilds.get(ctx.guild_id)
         # If the user already has a booking, don't allow them to book another timeslot
         user_id = ctx.author.id
-        if self.timeslots.has_booking(user_id):
+        if guild.timeslots.has_booking(user_id):
             await ctx.respond("You already have a booking.", ephemeral=True)
             return
         
@@ -288,31 +556,63 @@ class Commands(Cog):
             return
                
         # If the timeslot does not exist, send an error message
-        if not self.timeslots.exists(timeslot_id):
+        if not guild.timeslots.exists(timeslot_id):
             await ctx.respond("Timeslot does not exist.", ephemeral=True)
             return
         
         # If the timeslot is already booked, don't allow the user to book it
-        if not self.timeslots.is_available(timeslot_id):
+        if guild.timeslots.get(timeslot_id).booking:
             await ctx.respond("Timeslot is already booked.", ephemeral=True)
             return
+
+        # A timeslot the user holds themselves, like after closing the modal, can be booked again
+        if guild.timeslots.is_held(timeslot_id, user_id):
+            await ctx.respond("Someone else is booking this timeslot right now, please pick another one.", ephemeral=True)
+            return
+
+        # Hold the timeslot while the user fills in the modal, so nobody else can take it in the meantime
+        if not guild.timeslots.hold(timeslot_id, user_id):
+            await ctx.respond("Timeslot is no longer available.", ephemeral=True)
+            return
         
         # Use BookingModal to get the user's meta and GOT usernames
         # The callback will book the timeslot
+        guild_id = ctx.guild_id
         async def callback(interaction: discord.Interaction, booking_data: dict):
-            booking_data["user_id"] = user_id
+            # The guild may have been unloaded while the modal was open, so look it up again
+            await self.guilds.wait_for(guild_id)
+            guild = self.guilds.get(guild_id)
             # Book the timeslot using the provided meta and GOT usernames
-            timeslot = self.timeslots.book(timeslot_id, booking_data)
+            timeslot = guild.timeslots.book(timeslot_id, Booking(user_id, **booking_data))
             if timeslot:
                 await interaction.response.send_message("Timeslot booked successfully.", ephemeral=True)
+                self.reminders.schedule(guild_id, timeslot)
                 
-                #Send a message to a specific discord channel when a timeslot is booked
-                channel = self.bot.get_channel(1215223888854917121)  # Replace with your channel ID
-                await channel.send(f"Timeslot booked: \n" + self.render_timeslots([timeslot]))
+                # Announce the booking in the guild's announcement channel, this doesn't wait for it to be sent
+                if guild.announcement_channel:
+                    self.announcer.announce(guild.announcement_channel, self.render_timeslot(timeslot))
                 
+            elif guild.timeslots.has_booking(user_id):
+                await interaction.response.send_message("You already have a booking.", ephemeral=True)
             else:
                 await interaction.response.send_message("Failed to book timeslot", ephemeral=True)
 
         # Show the booking modal to the user
         modal = BookingModal(callback, title="Book timeslot")
         await ctx.send_modal(modal)
+
+    @slash_command(name="stats", default_member_permissions=Permissions(administrator=True), guild_ids=guild_ids)
+    async def show_stats(self, ctx: discord.ApplicationContext):
+        """Show how long commands and storage take."""
+        lines = stats.summary()
+        if not lines:
+            await ctx.respond("No stats yet.", ephemeral=True)
+            return
+
+        # Keep the message within Discord's limit, the slowest metrics come first
+        message = ""
+        for line in lines:
+            if len(message) + len(line) + 1 > 1900:
+                break
+            message += line + "\n"
+        await ctx.respond(f"```\n{message}```", ephemeral=True)
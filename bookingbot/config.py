@@ -1,4 +1,27 @@
+import os
+
+
 class Config:
     def __init__(self):
+        # How the stores persist their data: "json" rewrites the whole file, "journal" appends changes to a log,
+        # "sqlite" keeps them in the database file below
+        self.storage = os.environ.get("BOOKINGBOT_STORAGE", "json")
+        self.database = os.environ.get("BOOKINGBOT_DATABASE", "data/bookingbot.db")
+        # Write the stores from a background thread, coalescing bursts of changes into one write
+        self.write_behind = os.environ.get("BOOKINGBOT_WRITE_BEHIND", "0") == "1"
+        # Seconds between writing the metrics to data/metrics.prom in the Prometheus text format, 0 to not write them
+        self.metrics_interval = float(os.environ.get("BOOKINGBOT_METRICS_INTERVAL", "0"))
+        # The most guilds kept in memory, the data of the least recently used guild is unloaded beyond this
+        self.guild_capacity = int(os.environ.get("BOOKINGBOT_GUILD_CAPACITY", "100"))
+        # Load the guild data in the background while the bot connects and babel on first use, to answer sooner after a restart
+        self.lazy_startup = os.environ.get("BOOKINGBOT_LAZY_STARTUP", "0") == "1"
+        # Seconds before a booked timeslot starts to remind the user and the instructor, comma separated
+        self.reminder_offsets = tuple(float(offset) for offset in os.environ.get("BOOKINGBOT_REMINDER_OFFSETS", "3600,600").split(",") if offset.strip())
+        # Lock the data files and merge what other processes write, for tools or a second bot using the same data/
+        self.shared = os.environ.get("BOOKINGBOT_SHARED", "0") == "1"
+
+    @property
+    def token(self):
+        # Only read when the bot connects, so tools like bookingadmin.py can use the config without a token
         with open('data/bot.token', 'r') as file:
-            self.token = file.read().strip()
+            return file.read().strip()
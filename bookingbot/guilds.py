@@ -0,0 +1,163 @@
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+from bookingbot.settings import Settings
+from bookingbot.startup import startup
+from bookingbot.stats import stats
+from bookingbot.store import Store
+from bookingbot.timeslots import Timeslots
+from bookingbot.timmie import Timmie
+
+_log = logging.getLogger(__name__)
+
+
+class Guild:
+    # All data of one guild: its settings, timmies, timeslots and guild configuration
+    # Guild configuration dict format: {"announcement_channel": 1234567890}
+
+    def __init__(self, guild_id: int, directory: str, announcement_channel: int = None):
+        os.makedirs(directory, exist_ok=True)
+        self.id = guild_id
+        self.settings = Settings(directory)
+        self.timmies = Timmie(directory)
+        self.timeslots = Timeslots(self.timmies, directory)
+        self.config = Store[dict](f"{directory}/guild.json", {})
+        self.__default_announcement_channel = announcement_channel
+
+    @property
+    def announcement_channel(self):
+        return self.config.data.get("announcement_channel", self.__default_announcement_channel)
+
+    def set_announcement_channel(self, channel_id: int):
+        self.config.data["announcement_channel"] = channel_id
+        self.config.sync({"announcement_channel": channel_id})
+
+    def refresh(self):
+        # Pick up what other processes wrote, only shared stores check and only reload when their files changed
+        for store in self.stores():
+            store.refresh()
+
+    def stores(self):
+        return (self.settings.store, self.timmies.timmies, self.timeslots.timeslots, self.timeslots.archive.index, self.config)
+
+    def close(self):
+        # Write anything still pending, the guild can be dropped from memory after this
+        for store in self.stores():
+            store.close()
+
+
+class Guilds:
+    # Loads the data of a guild the first time it is used and keeps at most `capacity` guilds in memory,
+    # the least recently used guild is closed and dropped when another one has to be loaded.
+    # Guild data lives in data/guilds/<guild id>/, except for the legacy guild that keeps using the files in data/
+    # from before the bot served more than one guild.
+
+    def __init__(self, capacity: int = 100, legacy_guild: int = None, legacy_announcement_channel: int = None, on_load=None):
+        self.capacity = capacity
+        self.legacy_guild = legacy_guild
+        self.legacy_announcement_channel = legacy_announcement_channel
+        # Called with every guild that was loaded
+        self.on_load = on_load
+        self.__guilds = OrderedDict()
+        # The lock only guards the dict, loading happens outside of it so other guilds stay usable meanwhile.
+        # guild id -> Event that is set when the thread loading the guild is done, a get of it waits for that.
+        self.__lock = threading.Lock()
+        self.__loading = {}
+
+    def get(self, guild_id: int) -> Guild:
+        while True:
+            with self.__lock:
+                guild = self.__guilds.get(guild_id)
+                if guild is not None:
+                    self.__guilds.move_to_end(guild_id)
+                    break
+                loading = self.__loading.get(guild_id)
+                if loading is None:
+                    self.__loading[guild_id] = threading.Event()
+                    break
+            # Another thread is loading the guild, look again once it's done, it may have failed.
+            # The event loop uses wait_for first so it doesn't block here.
+            loading.wait()
+
+        if guild is None:
+            return self.__load(guild_id)
+        guild.refresh()
+        return guild
+
+    async def wait_for(self, guild_id: int):
+        # Wait for a guild that another thread is still loading, like a preload, without blocking the event loop.
+        # A get right after this doesn't have to wait, unless the guild was evicted and is loading again meanwhile.
+        while True:
+            with self.__lock:
+                loading = self.__loading.get(guild_id)
+            if loading is None:
+                return
+            await asyncio.get_running_loop().run_in_executor(None, loading.wait)
+
+    def __load(self, guild_id: int) -> Guild:
+        evicted = []
+        try:
+            start = time.perf_counter()
+            if guild_id == self.legacy_guild:
+                guild = Guild(guild_id, self.directory(guild_id), self.legacy_announcement_channel)
+            else:
+                guild = Guild(guild_id, self.directory(guild_id))
+            duration = time.perf_counter() - start
+            stats.observe("guild.load", duration)
+            startup.record("loading the first guild", duration)
+
+            with self.__lock:
+                self.__guilds[guild_id] = guild
+                while len(self.__guilds) > self.capacity:
+                    evicted.append(self.__guilds.popitem(last=False)[1])
+        finally:
+            with self.__lock:
+                self.__loading.pop(guild_id).set()
+
+        for guild_evicted in evicted:
+            _log.info(f"Unloading guild {guild_evicted.id}")
+            guild_evicted.close()
+        # The guild is in loaded() by now, like for the expiry task that on_load wakes up
+        if self.on_load is not None:
+            self.on_load(guild)
+        return guild
+
+    def preload(self, guild_id: int):
+        # Load the guild from a background thread, so it's ready by the time the first command comes in
+        def load():
+            try:
+                self.get(guild_id)
+            except Exception:
+                _log.exception(f"Failed to preload guild {guild_id}")
+
+        thread = threading.Thread(target=load, name=f"preload-{guild_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def directory(self, guild_id: int):
+        return "data" if guild_id == self.legacy_guild else f"data/guilds/{guild_id}"
+
+    def stored(self):
+        # The IDs of all guilds that have data, loaded or not
+        guild_ids = [self.legacy_guild] if self.legacy_guild is not None else []
+        if os.path.isdir("data/guilds"):
+            guild_ids += [int(name) for name in os.listdir("data/guilds") if name.isdigit() and int(name) != self.legacy_guild]
+        return guild_ids
+
+    def stored_timeslots(self, guild_id: int):
+        # The timeslots of a guild read from its store, without loading the guild
+        return Timeslots.read(self.directory(guild_id))
+
+    def loaded(self):
+        with self.__lock:
+            return list(self.__guilds.values())
+
+    def close(self):
+        with self.__lock:
+            for guild in self.__guilds.values():
+                guild.close()
+            self.__guilds.clear()
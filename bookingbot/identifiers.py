@@ -0,0 +1,70 @@
+from collections import deque
+import datetime
+import random
+import string
+import time
+
+from bookingbot.stats import stats
+
+
+class IdAllocator:
+    # Hands out the short IDs users type to refer to timeslots, an ID is never one that is in use
+    #
+    # IDs are 5 random characters, without 'o', 'O' and '0' so they can't be mixed up. A drawn ID is checked against
+    # the live IDs with `taken`, the caller's O(1) lookup, and against the IDs that were handed out or freed in the
+    # last `grace` seconds. Handed out IDs are held back until the timeslot is added, freed IDs because messages and
+    # reminders still refer to a removed or archived timeslot for a while, a new timeslot shouldn't answer to them.
+    # When draws keep colliding the IDs get a character longer, so allocating never spins on a crowded ID space.
+    # What is held back is only kept in memory, the owner frees the IDs it knows were freed recently when it starts,
+    # like Timeslots does with the archive's recent IDs.
+
+    characters = (string.ascii_letters + string.digits).replace('o', '').replace('O', '').replace('0', '')
+    length = 5
+    max_attempts = 10
+    grace = datetime.timedelta(days=1).total_seconds()
+
+    def __init__(self, taken, rng: random.Random = None):
+        self.taken = taken
+        self.rng = rng or random.Random()
+        # id -> until when it's held back, and the same as (until, id) in the order they were held back
+        self.__recent = {}
+        self.__expiry = deque()
+
+    def allocate(self, count: int = None):
+        # One new ID, or a list of count new IDs for a batch of timeslots
+        if count is None:
+            return self.__allocate(time.time())
+        now = time.time()
+        return [self.__allocate(now) for _ in range(count)]
+
+    def free(self, identifier: str, freed_at: float = None):
+        # The timeslot with the ID is gone, hold the ID back for the grace period from when that happened
+        self.__hold(identifier, time.time() if freed_at is None else freed_at)
+
+    def is_free(self, identifier: str, now: float = None):
+        now = time.time() if now is None else now
+        return not self.taken(identifier) and self.__recent.get(identifier, 0) <= now
+
+    def __allocate(self, now: float):
+        self.__prune(now)
+        length = self.length
+        attempts = 0
+        while True:
+            identifier = "".join(self.rng.choices(self.characters, k=length))
+            if self.is_free(identifier, now):
+                self.__hold(identifier, now)
+                return identifier
+            stats.increment("ids.collisions")
+            attempts += 1
+            if attempts % self.max_attempts == 0:
+                length += 1
+
+    def __hold(self, identifier: str, now: float):
+        self.__recent[identifier] = now + self.grace
+        self.__expiry.append((now + self.grace, identifier))
+
+    def __prune(self, now: float):
+        while self.__expiry and self.__expiry[0][0] <= now:
+            until, identifier = self.__expiry.popleft()
+            if self.__recent.get(identifier) == until:
+                del self.__recent[identifier]
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+
+# Typed records for the timeslots, converted from and to their JSON form when a Store loads and writes them
+#
+# Discord IDs are ints in memory, whatever they were in the file. JSON turns dict keys into strings, so without
+# normalizing a user ID read back from disk doesn't match the int the commands look it up with.
+# The same user shows up in many timeslots, user IDs are interned so all of them share one int object.
+
+_user_ids = {}
+
+
+def user_id(value) -> int:
+    # The normalized, interned form of a Discord user ID
+    value = int(value)
+    return _user_ids.setdefault(value, value)
+
+
+@dataclass(slots=True)
+class Booking:
+    user_id: int
+    got_username: str = ""
+    meta_username: str = ""
+
+    def __post_init__(self):
+        self.user_id = user_id(self.user_id)
+
+    def to_json(self) -> dict:
+        return {"user_id": self.user_id, "meta_username": self.meta_username, "got_username": self.got_username}
+
+    @classmethod
+    def from_json(cls, value: dict):
+        # Open timeslots used to be written with an empty booking dict
+        if not value:
+            return None
+        return cls(value["user_id"], value.get("got_username") or "", value.get("meta_username") or "")
+
+
+@dataclass(slots=True)
+class Timeslot:
+    id: str
+    time: float
+    instructor: int
+    booking: Booking = None
+
+    def __post_init__(self):
+        self.instructor = user_id(self.instructor)
+
+    def to_json(self) -> dict:
+        value = {"id": self.id, "time": self.time, "instructor": self.instructor}
+        if self.booking is not None:
+            value["booking"] = self.booking.to_json()
+        return value
+
+    @classmethod
+    def from_json(cls, value: dict):
+        return cls(value["id"], value["time"], value["instructor"], Booking.from_json(value.get("booking")))
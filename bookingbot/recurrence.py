@@ -0,0 +1,45 @@
+import datetime
+from typing import Iterator
+
+# Recurring timeslots, like "weekdays 18:00 for 4 weeks"
+# Days are given as "daily", "weekdays", "weekends" or a comma separated list of day names like "mon,wed,fri"
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+DAY_PATTERNS = {
+    "daily": set(range(7)),
+    "weekdays": set(range(5)),
+    "weekends": {5, 6},
+}
+
+
+def parse_days(days: str) -> set:
+    days = days.strip().lower()
+    if days in DAY_PATTERNS:
+        return DAY_PATTERNS[days]
+
+    weekdays = set()
+    for day in days.replace(" ", ",").split(","):
+        if not day:
+            continue
+        if day[:3] not in DAY_NAMES:
+            raise ValueError(f"Unknown day '{day}'")
+        weekdays.add(DAY_NAMES.index(day[:3]))
+    if not weekdays:
+        raise ValueError("No days given")
+    return weekdays
+
+
+def occurrences(timezone, current_time: datetime.datetime, times_of_day: list, weekdays: set, weeks: int) -> Iterator[datetime.datetime]:
+    # Yield every (hour, minute) of times_of_day on the given weekdays, starting from current_time for the given
+    # number of weeks, in chronological order. timezone is a pytz timezone and current_time is in that timezone.
+    # Every occurrence is localized on its own so daylight saving changes within the range are respected.
+    times_of_day = sorted(times_of_day)
+    for offset in range(weeks * 7):
+        date = current_time.date() + datetime.timedelta(days=offset)
+        if date.weekday() not in weekdays:
+            continue
+        for hour, minute in times_of_day:
+            start_time = timezone.normalize(timezone.localize(datetime.datetime.combine(date, datetime.time(hour, minute))))
+            if start_time > current_time:
+                yield start_time
@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+
+from bookingbot.records import Timeslot
+from bookingbot.stats import stats
+
+_log = logging.getLogger(__name__)
+
+
+class Reminders:
+    # Sends a DM to the user who booked a timeslot and to its instructor, `offsets` seconds before the timeslot starts
+    #
+    # Pending reminders are a min-heap of (due time, guild id, timeslot id, offset), one task sleeps until the first
+    # one is due. Nothing is unscheduled: when a reminder comes up it's only sent if the timeslot is still booked and
+    # still starts at the same time, so removed timeslots simply don't get theirs.
+    # Reminders are scheduled when a timeslot is booked and for all booked timeslots when a guild is loaded. At start
+    # they are rebuilt for the guilds that aren't loaded too, from a background thread that reads their stored
+    # timeslots without loading them. Scheduling the same reminder twice, like for a guild loaded again after it
+    # was unloaded, is a no-op. Guilds can be loaded from other threads, so the heap has a lock.
+
+    def __init__(self, bot, offsets: tuple = (3600, 600)):
+        self.bot = bot
+        self.offsets = offsets
+        self.guilds = None
+        self.__heap = []
+        self.__scheduled = set()
+        self.__lock = threading.Lock()
+        self.__wakeup = asyncio.Event()
+        self.__loop = None
+        self.__task = None
+
+    def schedule(self, guild_id: int, timeslot: Timeslot, now: float = None):
+        now = time.time() if now is None else now
+        added = False
+        with self.__lock:
+            for offset in self.offsets:
+                reminder = (timeslot.time - offset, guild_id, timeslot.id, offset)
+                if reminder[0] > now and reminder not in self.__scheduled:
+                    heapq.heappush(self.__heap, reminder)
+                    self.__scheduled.add(reminder)
+                    added = True
+        if added:
+            self.__wake()
+
+    def schedule_guild(self, guild):
+        # Schedule the reminders of every booked timeslot of a guild that was just loaded
+        self.schedule_timeslots(guild.id, guild.timeslots.list())
+
+    def schedule_timeslots(self, guild_id: int, timeslots):
+        now = time.time()
+        for timeslot in timeslots:
+            if timeslot.booking is not None:
+                self.schedule(guild_id, timeslot, now)
+
+    @property
+    def pending(self):
+        return len(self.__heap)
+
+    def start(self, guilds):
+        self.guilds = guilds
+        if self.__task is None:
+            self.__loop = asyncio.get_running_loop()
+            self.__task = asyncio.create_task(self.__run())
+            threading.Thread(target=self.schedule_stored, name="reminders-scan", daemon=True).start()
+
+    def schedule_stored(self):
+        # Schedule the reminders of the guilds that have data but aren't loaded, straight from their stores
+        loaded = {guild.id for guild in self.guilds.loaded()}
+        for guild_id in self.guilds.stored():
+            if guild_id in loaded:
+                continue
+            try:
+                self.schedule_timeslots(guild_id, self.guilds.stored_timeslots(guild_id))
+            except Exception:
+                _log.exception(f"Failed to schedule the reminders of guild {guild_id}")
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    def due(self, now: float = None):
+        # Pops the reminders that are due
+        now = time.time() if now is None else now
+        due = []
+        with self.__lock:
+            while self.__heap and self.__heap[0][0] <= now:
+                reminder = heapq.heappop(self.__heap)
+                self.__scheduled.discard(reminder)
+                due.append(reminder)
+        return due
+
+    def __next_due(self):
+        with self.__lock:
+            return self.__heap[0][0] if self.__heap else None
+
+    def __wake(self):
+        # Before the task runs there is nothing to wake, it looks at the heap when it starts
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__wakeup.set)
+
+    async def __run(self):
+        while True:
+            for due_at, guild_id, timeslot_id, offset in self.due():
+                try:
+                    await self.__remind(due_at, guild_id, timeslot_id, offset)
+                except Exception:
+                    _log.exception(f"Failed to send reminders for timeslot {timeslot_id}")
+
+            next_due = self.__next_due()
+            timeout = None if next_due is None else max(0, next_due - time.time())
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __remind(self, due_at: float, guild_id: int, timeslot_id: str, offset: float):
+        await self.guilds.wait_for(guild_id)
+        timeslot = self.guilds.get(guild_id).timeslots.get(timeslot_id)
+        if timeslot is None or timeslot.booking is None or timeslot.time - offset != due_at:
+            stats.increment("reminders.skipped")
+            return
+
+        starts = f"<t:{int(timeslot.time)}:R>"
+        await self.__send(timeslot.booking.user_id, f"Reminder: your session with <@{timeslot.instructor}> starts {starts}.")
+        await self.__send(timeslot.instructor, f"Reminder: <@{timeslot.booking.user_id}> booked your timeslot `{timeslot.id}`, it starts {starts}.")
+
+    async def __send(self, user_id: int, message: str):
+        try:
+            user = await self.bot.get_or_fetch_user(user_id)
+            if user is None:
+                return
+            await user.send(message)
+            stats.increment("reminders.sent")
+        except Exception:
+            # Like when the user doesn't accept DMs
+            _log.warning(f"Failed to send a reminder to {user_id}", exc_info=True)
+            stats.increment("reminders.failed")
@@ -1,46 +1,103 @@
 
 import datetime
 
-from babel import Locale
+import pytz
 from bookingbot.store import Store
-from babel.dates import format_date
+
+
+class Profile:
+    # The settings of a user resolved into the objects the commands work with
+    # timezone is a pytz timezone and locale a babel Locale, both None when not set (or not valid)
+    __slots__ = ("timezone", "locale", "month_first", "date_format")
+
+    def __init__(self, timezone, locale, month_first: bool):
+        self.timezone = timezone
+        self.locale = locale
+        self.month_first = month_first
+        self.date_format = "MM/DD" if month_first else "DD/MM"
+
 
 class Settings:
-    def __init__(self):
-        self.store = Store[dict](f"data/settings.json", {})
-        
+    # Whether a territory writes the month first only depends on the territory, so it's shared by all users
+    __month_first_by_territory = {}
+
+    def __init__(self, directory: str = "data"):
+        self.store = Store[dict](f"{directory}/settings.json", {}, on_reload=lambda: self.__profiles.clear())
+        self.__profiles = {}
+
+    @classmethod
+    def clear_territories(cls):
+        # Forget the month order of every territory, the next profile of each territory resolves it again
+        cls.__month_first_by_territory.clear()
+
     def set_timezone(self, user_id: str, timezone: str):
         if not self.store.data.get(str(user_id)):
             self.store.data[str(user_id)] = {}
-        
+
         self.store.data[str(user_id)]["timezone"] = timezone
-        self.store.sync()
-        
+        self.__profiles.pop(str(user_id), None)
+        self.store.sync({str(user_id): self.store.data[str(user_id)]})
+
     def get_timezone(self, user_id: str):
         return self.store.data.get(str(user_id), {}).get("timezone")
-    
+
     def set_locale(self, user_id: str, locale: str):
         if not self.store.data.get(str(user_id)):
             self.store.data[str(user_id)] = {}
-        
+
         self.store.data[str(user_id)]["locale"] = locale
-        self.store.sync()
-        
+        self.__profiles.pop(str(user_id), None)
+        self.store.sync({str(user_id): self.store.data[str(user_id)]})
+
+    def set_many(self, settings):
+        # Set the settings of many users with a single sync, settings are (user_id, {"timezone": ..., "locale": ...})
+        changes = {}
+        for user_id, values in settings:
+            changes[str(user_id)] = self.store.data.setdefault(str(user_id), {})
+            changes[str(user_id)].update(values)
+            self.__profiles.pop(str(user_id), None)
+
+        if changes:
+            self.store.sync(changes)
+        return len(changes)
+
     def get_locale(self, user_id: str):
-        territory = self.store.data.get(str(user_id), {}).get("locale")
-        if not territory:
-            return None
-        return Locale("en",  territory)
-    
+        return self.get_profile(user_id).locale
+
     def is_month_first(self, user_id: str):
-        locale = self.get_locale(user_id)
-        if not locale:
-            return False
-        
-        return self.__is_month_first(locale)
+        return self.get_profile(user_id).month_first
+
+    def get_profile(self, user_id: str) -> Profile:
+        profile = self.__profiles.get(str(user_id))
+        if profile is None:
+            profile = self.__resolve(str(user_id))
+            self.__profiles[str(user_id)] = profile
+        return profile
+
+    def __resolve(self, user_id: str) -> Profile:
+        settings = self.store.data.get(user_id, {})
+
+        timezone = None
+        if settings.get("timezone"):
+            try:
+                timezone = pytz.timezone(settings["timezone"])
+            except pytz.UnknownTimeZoneError:
+                pass
+
+        territory = settings.get("locale")
+        if not territory:
+            return Profile(timezone, None, False)
+
+        # babel and its locale data are only loaded once a user with a locale shows up
+        from babel import Locale
+
+        if territory not in Settings.__month_first_by_territory:
+            Settings.__month_first_by_territory[territory] = self.__is_month_first(Locale("en", territory))
+        return Profile(timezone, Locale("en", territory), Settings.__month_first_by_territory[territory])
 
     def __is_month_first(self, locale):
+        from babel.dates import format_date
         date = datetime.date(2022, 10, 25)  # A date where day and month are different
         formatted_date = format_date(date, "short", locale=locale)
         # Split the date string and check if the first part is the month
-        return formatted_date.split('/')[0] == '10'
\ No newline at end of file
+        return formatted_date.split('/')[0] == '10'
@@ -0,0 +1,47 @@
+import logging
+import threading
+import time
+
+_log = logging.getLogger(__name__)
+
+# Milestones of starting the bot, in seconds since this module was imported
+#
+# bookingbot.py imports this module first, marks when its imports are done and when the bot is ready, the guilds mark
+# how long loading their stores took and the Commands cog marks the first command. Once that one has been answered the
+# whole startup is logged as a single line.
+
+
+class Startup:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.milestones = {}
+        self.durations = {}
+        self.reported = False
+        self.__lock = threading.Lock()
+
+    def mark(self, name: str):
+        # Only the first time counts, later calls are ignored
+        with self.__lock:
+            self.milestones.setdefault(name, time.perf_counter() - self.started)
+
+    def record(self, name: str, seconds: float):
+        with self.__lock:
+            self.durations.setdefault(name, seconds)
+
+    def report(self):
+        with self.__lock:
+            milestones = sorted(self.milestones.items(), key=lambda item: item[1])
+            durations = list(self.durations.items())
+        return ", ".join([f"{name} at {seconds:.3f}s" for name, seconds in milestones] +
+                         [f"{name} took {seconds:.3f}s" for name, seconds in durations])
+
+    def first_command(self, seconds: float):
+        if self.reported:
+            return
+        self.reported = True
+        self.mark("first command")
+        self.record("first command", seconds)
+        _log.info(f"Startup: {self.report()}")
+
+
+startup = Startup()
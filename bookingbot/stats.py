@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters and latency histograms
+#
+# Metrics are identified by a name and optional labels, like observe("store.sync", 0.01, store="timeslots").
+# Latencies are kept in fixed buckets so recording is O(1) and memory doesn't grow with traffic, percentiles are
+# estimated from the buckets. Everything can be rendered in the Prometheus text format.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction: float):
+        # The upper bound of the bucket the quantile falls in, the largest finite bound when it's beyond those
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for index, bound in enumerate(BUCKETS):
+            cumulative += self.counts[index]
+            if cumulative >= target:
+                return bound if bound != float("inf") else BUCKETS[-2]
+        return BUCKETS[-2]
+
+
+class Stats:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        # Writers can be store threads, the lock keeps the updates whole
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __key(name: str, labels: dict):
+        return (name, tuple(sorted(labels.items())))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = self.__key(name, labels)
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self.__key(name, labels)
+        with self.__lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        # Decorator recording the duration of every call, works for both plain and async functions
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.__lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def summary(self):
+        # One line per metric, slowest p99 first
+        with self.__lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[1].quantile(0.99), reverse=True)
+            counters = sorted(self.counters.items())
+
+        lines = []
+        for (name, labels), histogram in histograms:
+            lines.append(f"{self.__label(name, labels)}: {histogram.count}x, avg {histogram.sum / histogram.count * 1000:.1f}ms, "
+                         f"p50 <{histogram.quantile(0.5) * 1000:g}ms, p99 <{histogram.quantile(0.99) * 1000:g}ms")
+        for (name, labels), value in counters:
+            lines.append(f"{self.__label(name, labels)}: {value:g}")
+        return lines
+
+    @staticmethod
+    def __label(name: str, labels: tuple):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+    def render_prometheus(self):
+        def metric(name: str):
+            return "bookingbot_" + name.replace(".", "_").replace(" ", "_").replace("-", "_")
+
+        def labels(pairs, extra: str = None):
+            parts = [f'{key}="{value}"' for key, value in pairs] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        with self.__lock:
+            histograms = {key: (list(histogram.counts), histogram.count, histogram.sum) for key, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = []
+        typed = set()
+        for (name, pairs), (counts, count, total) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {metric(name)}_seconds histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = labels(pairs, f'le="{le}"')
+                lines.append(f"{metric(name)}_seconds_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{metric(name)}_seconds_sum{labels(pairs)} {total}")
+            lines.append(f"{metric(name)}_seconds_count{labels(pairs)} {count}")
+        for (name, pairs), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {metric(name)}_total counter")
+                typed.add(name)
+            lines.append(f"{metric(name)}_total{labels(pairs)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file: str):
+        temp_file = f"{file}.tmp"
+        with open(temp_file, "w") as metrics:
+            metrics.write(self.render_prometheus())
+        os.replace(temp_file, file)
+
+
+stats = Stats()
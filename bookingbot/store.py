@@ -1,32 +1,632 @@
+import asyncio
+import atexit
+import copy
 import json
+import logging
 import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from typing import Generic, TypeVar
 
+from bookingbot.stats import stats
+
+try:
+    import fcntl
+except ImportError:
+    # There are no advisory locks on Windows, shared stores still detect and merge changes there
+    fcntl = None
+
 T = TypeVar('T')
 
+_log = logging.getLogger(__name__)
+
+
+class StoreConflict(Exception):
+    # Another process changed keys that a sync changes too, the sync was not written
+    def __init__(self, file: str, keys: list):
+        super().__init__(f"'{file}' was changed by another process: {', '.join(keys)}")
+        self.keys = keys
+
 
 class Store(Generic[T]):
+    # A store keeps a JSON document in memory and persists it to a file.
+    #
+    # By default every sync rewrites the whole file. In journal mode a sync with changes only appends those
+    # changes to "<file>.journal", one JSON record per line: {"key": ..., "value": ...} or {"key": ..., "deleted": true}.
+    # Changes are given as {key: value}, a value of None means the key was removed. For dict data the key is the
+    # dict key, for list data the key is the value of the `key` field of each item.
+    # Once enough records have been appended the journal is compacted into a fresh snapshot in the background.
+    #
+    # In write-behind mode sync only marks the store dirty. A writer thread waits `flush_delay` seconds so a burst
+    # of syncs turns into a single write, then serializes and writes the data off the event loop.
+    # A mutation that races with the serialization queues its own sync, so a torn snapshot is always rewritten.
+    #
+    # With a `database` the data lives in a SQLite table named after the path of the file under `root`, the data
+    # directory, instead, one row per key with the value as JSON. Changes become upserts and deletes in a single transaction. `indexes` are JSON paths inside
+    # the values, like "booking.user_id", that get an index. The first time the table is used it is filled from
+    # the JSON file (and journal), which is then renamed to "<file>.migrated".
+    #
+    # `decode` turns a JSON item (a list item or dict value) into the object kept in memory and `encode` turns it
+    # back, every write goes through encode so the file, journal and table only ever hold the JSON form.
+    # `key_type` converts the keys of dict data after loading, JSON only has string keys.
+    #
+    # A `shared` store can be used by more than one process at a time. Loads and writes hold an flock on
+    # "<file>.lock", and the store remembers the stat of its files and a hash of every key as it last saw them.
+    # refresh() only reloads when the files changed. A sync that finds the files changed merges per key: changes of
+    # other processes are adopted, unless they changed a key this sync changes too, then StoreConflict is raised,
+    # the data is reloaded and nothing is written. `on_reload` is called whenever the data was replaced from disk.
+    # Shared stores always write synchronously, a conflict has to reach the caller. With a database a sync only
+    # writes the rows that are still as this process last saw them, otherwise it raises StoreConflict the same way,
+    # and refresh() reloads when another connection committed. claim() is a compare-and-set for keys
+    # that only one process may change, like booking a timeslot. locked() holds the file lock over several steps
+    # and starts from the latest data, so what is written inside it can't conflict.
+    #
+    # A read_only store only loads the data, it never folds a journal or migrates a file, for a look at the data of
+    # another process.
+    #
+    # Options not passed to the constructor come from Store.configure.
+
+    defaults = {}
+
+    def __init__(self, file: str, empty: T, key: str = None, indexes: tuple = (), encode=None, decode=None, key_type=None,
+                 on_reload=None, **options):
+        options = {**Store.defaults, **{name: value for name, value in options.items() if value is not None}}
 
-    def __init__(self, file: str, empty: T):
         self.__file = file
+        self.__name = os.path.splitext(os.path.basename(file))[0]
+        # Stores of a guild live in <root>/guilds/<id>/, their table names include that path
+        path = os.path.relpath(file, options.get("root", "data"))
+        self.__path = os.path.splitext(path if not path.startswith("..") else os.path.basename(file))[0]
         self.__empty = empty
-        self.data: T = self.__load()
+        self.__key = key
+        self.__indexes = indexes
+        self.__encode = encode
+        self.__decode = decode
+        self.__key_type = key_type
+        self.__on_reload = on_reload
+        self.__shared = options.get("shared", False)
+        self.__lock_file = None
+        # The file lock can be taken again by a thread that holds it, like a sync within locked()
+        self.__file_lock_holder = threading.RLock()
+        self.__file_lock_depth = 0
+        # The stat of the files and {key: hash of its JSON} as this process last saw them, for shared stores
+        self.__seen = None
+        self.__base = {}
+        self.__journal = options.get("journal", False)
+        # Only load, for a look at data that another Store of the same file may be using, nothing is written
+        self.__read_only = options.get("read_only", False)
+        self.__compact_after = options.get("compact_after", 1000)
+        self.__journal_records = 0
+        self.__lock = threading.Lock()
+        self.__compaction = None
+        self.__database = None
+        with stats.timer("store.load", store=self.__name):
+            if options.get("database"):
+                self.__table = re.sub(r"\W", "_", self.__path)
+                self.__database = self.__open_database(options["database"])
+                self.data: T = self.__load_database()
+                self.__seen = self.__signature()
+                if self.__shared:
+                    self.__remember()
+            else:
+                with self.__file_lock():
+                    self.data: T = self.__load()
+                    if self.__shared:
+                        self.__remember()
+
+        self.__writer = None
+        if options.get("write_behind", False) and not self.__shared:
+            self.__flush_delay = options.get("flush_delay", 0.5)
+            self.__pending_changes = {}
+            self.__pending_full = False
+            self.__flushing = False
+            self.__urgent = False
+            self.__stopping = False
+            self.__dirty = threading.Condition()
+            self.__writer = threading.Thread(target=self.__run_writer, name=f"writer {self.__file}", daemon=True)
+            self.__writer.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def configure(cls, **options):
+        # Set the default options for stores created after this call
+        cls.defaults = options
 
     @property
     def file(self):
         return self.__file
 
+    @property
+    def journal_file(self):
+        return f"{self.__file}.journal"
+
+    def __open_database(self, database: str):
+        connection = sqlite3.connect(database, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{self.__table}" (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            for path in self.__indexes:
+                name = self.__table + "_" + re.sub(r"\W", "_", path)
+                connection.execute(f"CREATE INDEX IF NOT EXISTS \"{name}\" ON \"{self.__table}\" (json_extract(value, '$.{path}'))")
+        return connection
+
+    def __load_database(self) -> T:
+        rows = self.__database.execute(f'SELECT key, value FROM "{self.__table}" ORDER BY rowid').fetchall()
+        if rows:
+            if isinstance(self.__empty, dict):
+                return self.__decoded({key: json.loads(value) for key, value in rows})
+            return self.__decoded([json.loads(value) for _, value in rows])
+
+        if not os.path.exists(self.__file):
+            return copy.deepcopy(self.__empty)
+
+        # One-shot migration of the JSON file, including a journal that may still be around
+        self.__journal = True
+        data = self.__load()
+        self.__journal = False
+        if self.__read_only:
+            return data
+        self.data = data
+        self.__write_database(None)
+        os.rename(self.__file, f"{self.__file}.migrated")
+        _log.info(f"Migrated '{self.__file}' into table '{self.__table}'")
+        return self.data
+
+    def __write_database(self, changes: dict) -> int:
+        ours = None
+        try:
+            with self.__lock, self.__database:
+                if self.__shared:
+                    # Only write rows that are still as this process last saw them, checked and written in one
+                    # write transaction so no other process can commit in between
+                    self.__database.execute("BEGIN IMMEDIATE")
+                    ours = self.__ours(changes)
+                    self.__check_database(ours)
+                    rows = [(key, json.dumps(value)) for key, value in ours.items() if value is not None]
+                    changes = ours
+                elif changes is None:
+                    self.__database.execute(f'DELETE FROM "{self.__table}"')
+                    data = self.__encoded(self.data)
+                    rows = [(str(key), json.dumps(value)) for key, value in
+                            (data.items() if isinstance(data, dict) else ((item[self.__key], item) for item in data))]
+                    changes = {}
+                else:
+                    rows = [(str(key), json.dumps(self.__encode_item(value))) for key, value in changes.items() if value is not None]
+
+                self.__database.executemany(
+                    f'INSERT INTO "{self.__table}" (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                    rows)
+                self.__database.executemany(
+                    f'DELETE FROM "{self.__table}" WHERE key = ?',
+                    [(str(key),) for key, value in changes.items() if value is None])
+        except StoreConflict:
+            stats.increment("store.conflicts", store=self.__name)
+            self.__reload_database()
+            raise
+
+        if ours is not None:
+            for key, value in ours.items():
+                if value is None:
+                    self.__base.pop(key, None)
+                else:
+                    self.__base[key] = self.__hash(value)
+        return sum(len(key) + len(value) for key, value in rows)
+
+    def __check_database(self, ours: dict):
+        # Called in the write transaction, raises StoreConflict when another process changed a key we're changing
+        conflicts = []
+        for key, value in ours.items():
+            row = self.__database.execute(f'SELECT value FROM "{self.__table}" WHERE key = ?', (key,)).fetchone()
+            stored = None if row is None else self.__hash(json.loads(row[0]))
+            if stored not in (self.__base.get(key), self.__hash(value)):
+                conflicts.append(key)
+        if conflicts:
+            raise StoreConflict(self.__file, sorted(conflicts))
+
+    def __reload_database(self):
+        self.data = self.__load_database()
+        self.__seen = self.__signature()
+        if self.__shared:
+            self.__remember()
+        if self.__on_reload is not None:
+            self.__on_reload()
+
     def __load(self) -> T:
+        data, replayed = self.__read()
+        if replayed and not self.__read_only:
+            # Fold the replayed journal into a fresh snapshot so we start with an empty journal
+            self.__write_snapshot(json.dumps(data))
+            for journal_file in (f"{self.journal_file}.old", self.journal_file):
+                if os.path.exists(journal_file):
+                    os.remove(journal_file)
+
+        return self.__decoded(data)
+
+    def __read(self):
+        # The JSON data as it is on disk, with the journal replayed, and the number of replayed records
         try:
             with open(self.__file, 'r') as file:
-                return json.load(file)
+                data = json.load(file)
         except FileNotFoundError:
-            print(f"'{self.__file}' not found, initialising")
-            return self.__empty
+            _log.info(f"'{self.__file}' not found, initialising")
+            data = copy.deepcopy(self.__empty)
         except:
-            os.rename(self.__file, f"{self.__file}.bad")
-            return self.__empty
+            if not self.__read_only:
+                os.rename(self.__file, f"{self.__file}.bad")
+            data = copy.deepcopy(self.__empty)
+
+        if not self.__journal:
+            return data, 0
+
+        replayed = 0
+        for journal_file in (f"{self.journal_file}.old", self.journal_file):
+            changes = self.__read_journal(journal_file)
+            replayed += len(changes)
+            data = self.__apply(data, changes)
+        return data, replayed
+
+    def __decoded(self, data: T) -> T:
+        if isinstance(data, dict):
+            if self.__key_type is not None:
+                data = {self.__key_type(key): value for key, value in data.items()}
+            if self.__decode is not None:
+                data = {key: self.__decode(value) for key, value in data.items()}
+            return data
+        if self.__decode is not None:
+            return [self.__decode(item) for item in data]
+        return data
+
+    def __encoded(self, data: T):
+        if self.__encode is None:
+            return data
+        if isinstance(data, dict):
+            return {key: self.__encode(value) for key, value in data.items()}
+        return [self.__encode(item) for item in data]
+
+    def __encode_item(self, value):
+        return value if self.__encode is None else self.__encode(value)
+
+    def __read_journal(self, journal_file: str) -> dict:
+        changes = {}
+        try:
+            with open(journal_file, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write at the end of the journal, everything before it is still valid
+                        _log.warning(f"Ignoring damaged record in '{journal_file}'")
+                        break
+                    changes[record["key"]] = None if record.get("deleted") else record["value"]
+        except FileNotFoundError:
+            pass
+        return changes
+
+    def __apply(self, data: T, changes: dict) -> T:
+        if not changes:
+            return data
+
+        if isinstance(data, dict):
+            for key, value in changes.items():
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+            return data
+
+        items = {item[self.__key]: item for item in data}
+        for key, value in changes.items():
+            if value is None:
+                items.pop(key, None)
+            else:
+                items[key] = value
+        return list(items.values())
+
+    def __record(self, key, value) -> str:
+        # Dict keys end up as strings in the snapshot, the journal has to match that
+        if isinstance(self.data, dict):
+            key = str(key)
+        if value is None:
+            return json.dumps({"key": key, "deleted": True}) + "\n"
+        return json.dumps({"key": key, "value": self.__encode_item(value)}) + "\n"
+
+    def sync(self, changes: dict = None):
+        stats.increment("store.syncs", store=self.__name)
+        if self.__shared and self.__database is None:
+            with self.__file_lock():
+                self.__merge(changes)
+                self.__write(changes)
+                self.__remember(changes)
+            return
+
+        if self.__writer is None:
+            self.__write(changes)
+            return
+
+        with self.__dirty:
+            self.__queue(changes)
+            self.__dirty.notify_all()
+
+    def refresh(self):
+        # Reload the data when another process changed it, returns whether it did. Only shared stores look.
+        if not self.__shared or self.__signature() == self.__seen:
+            return False
+
+        stats.increment("store.reloads", store=self.__name)
+        if self.__database is not None:
+            self.__reload_database()
+            return True
+
+        with self.__file_lock():
+            self.data = self.__load()
+            self.__remember()
+        if self.__on_reload is not None:
+            self.__on_reload()
+        return True
+
+    def claim(self, changes: dict, unset: str):
+        # Like sync, but in a shared database a key is only written while its stored value doesn't have the JSON path
+        # `unset` set yet, otherwise nothing is written, the data is reloaded and StoreConflict is raised.
+        # Shared files already detect that in sync, other stores are only changed by this process.
+        if not self.__shared or self.__database is None:
+            self.sync(changes)
+            return
+
+        stats.increment("store.syncs", store=self.__name)
+        conflicts = []
+        try:
+            with self.__lock, self.__database:
+                for key, value in changes.items():
+                    cursor = self.__database.execute(
+                        f"UPDATE \"{self.__table}\" SET value = ? WHERE key = ? AND json_extract(value, '$.{unset}') IS NULL",
+                        (json.dumps(self.__encode_item(value)), str(key)))
+                    if cursor.rowcount == 0:
+                        conflicts.append(str(key))
+                if conflicts:
+                    raise StoreConflict(self.__file, conflicts)
+        except StoreConflict:
+            stats.increment("store.conflicts", store=self.__name)
+            self.__reload_database()
+            raise
+        self.__remember(changes)
+
+    @contextmanager
+    def locked(self):
+        # Hold the file lock of a shared store, after reloading what other processes changed
+        with self.__file_lock():
+            self.refresh()
+            yield
+
+    @contextmanager
+    def __file_lock(self):
+        if not self.__shared or fcntl is None:
+            yield
+            return
+
+        with self.__file_lock_holder:
+            if self.__file_lock_depth == 0:
+                if self.__lock_file is None:
+                    os.makedirs(os.path.dirname(self.__file) or ".", exist_ok=True)
+                    self.__lock_file = open(f"{self.__file}.lock", "a")
+                fcntl.flock(self.__lock_file, fcntl.LOCK_EX)
+            self.__file_lock_depth += 1
+            try:
+                yield
+            finally:
+                self.__file_lock_depth -= 1
+                if self.__file_lock_depth == 0:
+                    fcntl.flock(self.__lock_file, fcntl.LOCK_UN)
+
+    def __signature(self):
+        # Changes whenever another process writes the files: a snapshot gets a new inode, a journal grows
+        if self.__database is not None:
+            return self.__database.execute("PRAGMA data_version").fetchone()[0]
+
+        def stat(file: str):
+            try:
+                result = os.stat(file)
+            except FileNotFoundError:
+                return None
+            return (result.st_mtime_ns, result.st_size, result.st_ino)
+        return (stat(self.__file), stat(self.journal_file) if self.__journal else None)
+
+    def __items(self, data) -> dict:
+        # JSON data as {key: JSON value}, keys as strings like they are on disk
+        if isinstance(data, dict):
+            return {str(key): value for key, value in data.items()}
+        return {str(item[self.__key]): item for item in data}
+
+    @staticmethod
+    def __hash(value):
+        return None if value is None else hash(json.dumps(value, sort_keys=True))
+
+    def __remember(self, changes: dict = None):
+        # Called with the file lock held, after loading or writing. A database keeps its own signature, what another
+        # connection committed before our write still has to be picked up by refresh().
+        if changes is None:
+            self.__base = {key: self.__hash(value) for key, value in self.__items(self.__encoded(self.data)).items()}
+        else:
+            for key, value in changes.items():
+                if value is None:
+                    self.__base.pop(str(key), None)
+                else:
+                    self.__base[str(key)] = self.__hash(self.__encode_item(value))
+        if self.__database is None:
+            self.__seen = self.__signature()
+
+    def __ours(self, changes: dict) -> dict:
+        # The changes as {key: JSON value}, keys as strings like they are on disk
+        if changes is None:
+            # Without the changed keys, everything that differs from what we last saw is ours
+            current = self.__items(self.__encoded(self.data))
+            return {key: current.get(key) for key in current.keys() | self.__base.keys()
+                    if self.__hash(current.get(key)) != self.__base.get(key)}
+        return {str(key): None if value is None else self.__encode_item(value) for key, value in changes.items()}
+
+    def __merge(self, changes: dict):
+        # Called with the file lock held before writing. When another process wrote since we last looked, adopt
+        # its changes, or raise StoreConflict when it changed a key we're changing too.
+        if self.__signature() == self.__seen:
+            return
+
+        disk, _ = self.__read()
+        disk = self.__items(disk)
+        disk_hashes = {key: self.__hash(value) for key, value in disk.items()}
+        ours = self.__ours(changes)
+        conflicts = sorted(key for key, value in ours.items()
+                           if disk_hashes.get(key) not in (self.__base.get(key), self.__hash(value)))
+        if not conflicts:
+            for key, value in ours.items():
+                if value is None:
+                    disk.pop(key, None)
+                else:
+                    disk[key] = value
+
+        self.data = self.__decoded(disk if isinstance(self.__empty, dict) else list(disk.values()))
+        self.__remember()
+        stats.increment("store.reloads", store=self.__name)
+        if self.__on_reload is not None:
+            self.__on_reload()
+        if conflicts:
+            stats.increment("store.conflicts", store=self.__name)
+            raise StoreConflict(self.__file, conflicts)
+
+    async def flush(self):
+        # Wait until everything synced so far has been written, without blocking the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.wait_for_flush)
+
+    def wait_for_flush(self):
+        if self.__writer is None:
+            return
+
+        with self.__dirty:
+            self.__urgent = True
+            self.__dirty.notify_all()
+            self.__dirty.wait_for(lambda: not self.__has_pending() and not self.__flushing)
+            self.__urgent = False
+
+    def close(self):
+        # Write anything still pending, stop the writer thread and let go of the files and database connection
+        if self.__writer is not None and self.__writer.is_alive():
+            with self.__dirty:
+                self.__stopping = True
+                self.__dirty.notify_all()
+            self.__writer.join()
+            atexit.unregister(self.close)
+        self.wait_for_compaction()
+        if self.__lock_file is not None:
+            self.__lock_file.close()
+            self.__lock_file = None
+        if self.__database is not None:
+            self.__database.close()
+
+    def __has_pending(self):
+        return self.__pending_full or bool(self.__pending_changes)
+
+    def __queue(self, changes: dict):
+        # Called with the condition held
+        if changes is None or not self.__journal:
+            self.__pending_full = True
+            self.__pending_changes = {}
+        elif not self.__pending_full:
+            self.__pending_changes.update(changes)
+
+    def __run_writer(self):
+        while True:
+            with self.__dirty:
+                self.__dirty.wait_for(lambda: self.__has_pending() or self.__stopping)
+                if self.__stopping and not self.__has_pending():
+                    return
+
+                # Give the rest of a burst the chance to arrive before writing
+                self.__dirty.wait_for(lambda: self.__urgent or self.__stopping, timeout=self.__flush_delay)
+
+                changes = None if self.__pending_full else self.__pending_changes
+                self.__pending_changes = {}
+                self.__pending_full = False
+                self.__flushing = True
+
+            try:
+                self.__write(changes)
+            except RuntimeError:
+                # The data changed while it was being serialized, try again with whatever is there now
+                with self.__dirty:
+                    self.__queue(changes)
+            except Exception:
+                _log.exception(f"Failed to write '{self.__file}'")
+            finally:
+                with self.__dirty:
+                    self.__flushing = False
+                    self.__dirty.notify_all()
+
+    def __write(self, changes: dict):
+        start = time.perf_counter()
+        written = self.__write_changes(changes)
+        stats.observe("store.write", time.perf_counter() - start, store=self.__name)
+        stats.increment("store.bytes_written", written, store=self.__name)
+
+    def __write_changes(self, changes: dict) -> int:
+        # Returns the number of bytes written
+        if self.__database is not None:
+            return self.__write_database(changes)
+
+        if not self.__journal or changes is None:
+            # A full write supersedes whatever a running compaction is about to write
+            self.wait_for_compaction()
+            with self.__lock:
+                content = json.dumps(self.__encoded(self.data), indent=None if self.__journal else 4)
+                self.__write_snapshot(content)
+                if self.__journal and os.path.exists(self.journal_file):
+                    os.remove(self.journal_file)
+                    self.__journal_records = 0
+            return len(content)
+
+        with self.__lock:
+            records = "".join(self.__record(key, value) for key, value in changes.items())
+            with open(self.journal_file, 'a') as journal:
+                journal.write(records)
+            self.__journal_records += len(changes)
+
+            if self.__journal_records >= self.__compact_after and not self.compacting:
+                self.__start_compaction()
+        return len(records)
+
+    @property
+    def compacting(self):
+        return self.__compaction is not None and self.__compaction.is_alive()
+
+    def wait_for_compaction(self):
+        if self.__compaction is not None:
+            self.__compaction.join()
+
+    def __start_compaction(self):
+        # Called with the lock held. The snapshot is serialized here so it can't race with later mutations,
+        # the current journal moves aside so new records go to a fresh one while the snapshot is written.
+        snapshot = json.dumps(self.__encoded(self.data))
+        os.replace(self.journal_file, f"{self.journal_file}.old")
+        self.__journal_records = 0
+
+        def compact():
+            self.__write_snapshot(snapshot)
+            os.remove(f"{self.journal_file}.old")
+            _log.info(f"Compacted journal of '{self.__file}'")
+
+        if self.__shared:
+            # Another process could start compacting as well, so it's done while holding the file lock
+            compact()
+            return
+        self.__compaction = threading.Thread(target=compact, name=f"compact {self.__file}")
+        self.__compaction.start()
 
-    def sync(self):
-        with open(self.__file, 'w') as jsonfile:
-            json.dump(self.data, jsonfile, indent=4)
+    def __write_snapshot(self, content: str):
+        # Write next to the real file and swap it in, a crash never leaves a half-written file behind
+        temp_file = f"{self.__file}.tmp"
+        with open(temp_file, 'w') as jsonfile:
+            jsonfile.write(content)
+            jsonfile.flush()
+            os.fsync(jsonfile.fileno())
+        os.replace(temp_file, self.__file)
@@ -1,61 +1,338 @@
+from bisect import bisect_left, bisect_right, insort
+import heapq
+import itertools
 from bookingbot import Store
+from bookingbot.store import StoreConflict
+from bookingbot.archive import Archive
+from bookingbot.identifiers import IdAllocator
+from bookingbot.records import Booking, Timeslot
+from bookingbot.stats import stats
 import datetime
+import logging
+import time
 
 from bookingbot.timmie import Timmie
 
+_log = logging.getLogger(__name__)
+
 
 class Timeslots:
     # This class is responsible for managing timeslots
-    # Timeslot data is stored in a JSON file
-    # Timeslot dict format: {"id": "unique identifier","time": <posix timestamp>, "instructor": "1234567890", "booking": {}}
-    # Booking dict means that a user has booked the timeslot, it's not set if the timeslot is open
-    # Booking dict format: {"user_id": "1234567890", "meta_username": "meta", "got_username": "got"}
-    
-    def __init__(self, timmies: Timmie):
-        self.timeslots = Store[list](f"data/timeslots.json", [])
+    # Timeslot data is stored in a JSON file or a SQLite table, see Store, and kept in memory as Timeslot records
+    # Timeslot JSON format: {"id": "unique identifier","time": <posix timestamp>, "instructor": 1234567890, "booking": {}}
+    # Booking means that a user has booked the timeslot, it's not set if the timeslot is open
+    # Booking JSON format: {"user_id": 1234567890, "meta_username": "meta", "got_username": "got"}
+    #
+    # The stored list is the source of truth, next to it we keep indexes so lookups don't scan every timeslot:
+    # - id -> timeslot
+    # - booked user_id -> timeslot
+    # - instructor -> {id: timeslot}
+    # - a list of (time, id) tuples kept sorted on time, for all timeslots and per instructor for the open ones
+    #
+    # available() answers queries like "the next 5 open timeslots between these times" by bisecting the open lists of
+    # the timmie's instructors to the start time and merging them lazily, so it only touches the timeslots it returns.
+    #
+    # Timeslots expire 10 minutes after they start. A min-heap of (expiry time, id) tells when the next one is due,
+    # expire() moves the due ones to the archive. Entries of removed timeslots stay in the heap and are skipped when popped.
+    # The archive is written before the live store, a crash in between archives those timeslots again rather than losing them.
+    # Expired timeslots that haven't been evicted yet are left out of every listing.
+    #
+    # A user can hold an open timeslot for a short while, like when the booking modal is open. Nobody else can book
+    # or hold it until the hold is released, claimed or runs out. Booking is a compare-and-set: it only succeeds
+    # when the timeslot is still open, not held by someone else and the user doesn't have a booking yet.
+    # Holds are only kept in memory, running out is checked whenever a hold is looked at.
+    #
+    # New timeslots get their ID from `ids`, which checks the id index so two timeslots never share an ID. Removed and
+    # expired timeslots give their ID back to it, it isn't handed out again for a while, also not after a restart for
+    # the IDs the archive has as recently archived.
+
+    expire_after = datetime.timedelta(minutes=10).total_seconds()
+    hold_duration = datetime.timedelta(minutes=5).total_seconds()
+
+    def __init__(self, timmies: Timmie, directory: str = "data"):
+        self.timeslots = self.store(directory, on_reload=lambda: self.__reindex())
         self.timmies = timmies
-        # Initialize any necessary attributes here
-        pass
+        self.archive = Archive(directory)
+        self.ids = IdAllocator(lambda timeslot_id: timeslot_id in self.__by_id)
+        for timeslot_id, archived_at in self.archive.recent_ids():
+            self.ids.free(timeslot_id, archived_at)
+        # timeslot id -> (user_id, hold ends at) and user_id -> timeslot id
+        self.__holds = {}
+        self.__held_by = {}
+        self.__reindex()
 
-    def add(self, timeslot: dict):
+    @staticmethod
+    def store(directory: str, on_reload=None, read_only: bool = None):
+        return Store[list](f"{directory}/timeslots.json", [], key="id", indexes=("instructor", "time", "booking.user_id"),
+                           encode=Timeslot.to_json, decode=Timeslot.from_json, on_reload=on_reload, read_only=read_only)
+
+    @staticmethod
+    def read(directory: str):
+        # The stored timeslots, without indexing them or opening the archive, for guilds that aren't loaded
+        store = Timeslots.store(directory, read_only=True)
+        try:
+            return store.data
+        finally:
+            store.close()
+
+    def add(self, timeslot: Timeslot):
+        if timeslot.id in self.__by_id:
+            raise ValueError(f"There already is a timeslot with ID {timeslot.id}")
         self.timeslots.data.append(timeslot)
-        self.__cleanup()
-        self.timeslots.sync()
-        
-    def list(self, instructor: str = None):
+        self.__index(timeslot)
+        self.timeslots.sync({timeslot.id: timeslot})
+
+    @stats.timed("timeslots.add_many")
+    def add_many(self, timeslots):
+        # Add a batch of timeslots with a single sync, returns the added timeslots
+        # A timeslot is skipped when its instructor already has a timeslot at the same time or its ID is in use
+        taken = {}
+        added = []
+        for timeslot in timeslots:
+            if timeslot.id in self.__by_id:
+                continue
+            instructor = timeslot.instructor
+            if instructor not in taken:
+                taken[instructor] = {existing.time for existing in self.__by_instructor.get(instructor, {}).values()}
+            if timeslot.time in taken[instructor]:
+                continue
+
+            taken[instructor].add(timeslot.time)
+            self.timeslots.data.append(timeslot)
+            self.__index(timeslot)
+            added.append(timeslot)
+
+        if added:
+            self.timeslots.sync({timeslot.id: timeslot for timeslot in added})
+        return added
+
+    @stats.timed("timeslots.list")
+    def list(self, instructor: int = None):
+        cutoff = self.__cutoff()
         if instructor is None:
-            return self.timeslots.data
-        
-        return [timeslot for timeslot in self.timeslots.data if timeslot["instructor"] == instructor]
-    
-    def list_unbooked_for_timmie(self, timmie_id: str):
-        timmie_instructors = self.timmies.list_instructors(timmie_id)
-        return [timeslot for timeslot in self.timeslots.data if not timeslot.get("booking") and timeslot["instructor"] in timmie_instructors]
-    
+            start = bisect_left(self.__by_time, (cutoff,))
+            return [self.__by_id[timeslot_id] for _, timeslot_id in self.__by_time[start:]]
+
+        timeslots = [timeslot for timeslot in self.__by_instructor.get(instructor, {}).values() if timeslot.time >= cutoff]
+        return sorted(timeslots, key=lambda x: x.time)
+
+    @stats.timed("timeslots.list_unbooked_for_timmie")
+    def list_unbooked_for_timmie(self, timmie_id: int):
+        return list(self.available(timmie_id))
+
+    def available(self, timmie_id: int, start: float = None, end: float = None, instructor: int = None, limit: int = None):
+        # The open timeslots the timmie can book, sorted by time, from start up to (not including) end, optionally
+        # only those of one instructor. Returns an iterator that finds the next timeslot as it's consumed.
+        start = self.__cutoff() if start is None else max(start, self.__cutoff())
+        instructors = self.timmies.list_instructors(timmie_id)
+        if instructor is not None:
+            instructors = [instructor] if instructor in instructors else []
+
+        def open_timeslots(instructor_id: int):
+            # The open list changes while the listing is consumed, so every step bisects again past the last one
+            after = None
+            while True:
+                times = self.__open_by_instructor.get(instructor_id, ())
+                position = bisect_left(times, (start,)) if after is None else bisect_right(times, after)
+                if position >= len(times) or (end is not None and times[position][0] >= end):
+                    return
+                after = times[position]
+                yield after
+
+        merged = heapq.merge(*(open_timeslots(instructor_id) for instructor_id in instructors))
+        timeslots = (self.__by_id.get(timeslot_id) for _, timeslot_id in merged)
+        # The listing can be consumed later, like page by page, skip what has been booked or removed in the meantime
+        timeslots = (timeslot for timeslot in timeslots
+                     if timeslot is not None and not timeslot.booking and not self.__held_by_other(timeslot.id, timmie_id))
+        return itertools.islice(timeslots, limit)
+
     def remove(self, timeslot_id: str):
-        self.timeslots.data = [timeslot for timeslot in self.timeslots.data if timeslot["id"] != timeslot_id]
-        self.__cleanup()
-        self.timeslots.sync()
-        
-    def has_booking(self, user_id: str):
-        return any([timeslot for timeslot in self.timeslots.data if timeslot.get("booking", {}).get("user_id") == user_id])
-    
-    def is_available(self, timeslot_id: str):
-        return any([timeslot for timeslot in self.timeslots.data if timeslot["id"] == timeslot_id and not timeslot.get("booking")])
-    
-    def book(self, timeslot_id: str, booking_data: dict):
-        for timeslot in self.timeslots.data:
-            if timeslot["id"] == timeslot_id and not timeslot.get("booking"):
-                timeslot["booking"] = booking_data
-                self.timeslots.sync()
-                self.timmies.clear(booking_data["user_id"])
-                return timeslot
-        return False
-    
+        timeslot = self.__by_id.get(timeslot_id)
+        if timeslot is not None:
+            self.__unindex(timeslot)
+            self.timeslots.data.remove(timeslot)
+        self.timeslots.sync({timeslot_id: None})
+
+    @stats.timed("timeslots.has_booking")
+    def has_booking(self, user_id: int):
+        # A booking of an expired timeslot that hasn't been evicted yet doesn't count
+        timeslot = self.__by_booker.get(user_id)
+        return timeslot is not None and timeslot.time >= self.__cutoff()
+
+    @stats.timed("timeslots.is_available")
+    def is_available(self, timeslot_id: str, user_id: int = None):
+        # Whether the timeslot can be booked, by user_id when given, a timeslot held by another user is not available
+        timeslot = self.__by_id.get(timeslot_id)
+        return (timeslot is not None and not timeslot.booking and timeslot.time >= self.__cutoff()
+                and not self.__held_by_other(timeslot_id, user_id))
+
+    def is_held(self, timeslot_id: str, user_id: int = None):
+        # Whether another user than user_id holds the timeslot
+        return self.__held_by_other(timeslot_id, user_id)
+
+    @stats.timed("timeslots.hold")
+    def hold(self, timeslot_id: str, user_id: int, duration: float = None):
+        # Hold the timeslot for the user, any other hold of the user is released. Returns whether the hold was taken.
+        if self.has_booking(user_id) or not self.is_available(timeslot_id, user_id):
+            stats.increment("timeslots.hold_conflicts")
+            return False
+
+        self.release(user_id)
+        self.__holds[timeslot_id] = (user_id, time.time() + (self.hold_duration if duration is None else duration))
+        self.__held_by[user_id] = timeslot_id
+        return True
+
+    def release(self, user_id: int):
+        # Release the hold of the user, if any
+        timeslot_id = self.__held_by.pop(user_id, None)
+        if timeslot_id is not None and self.__holds.get(timeslot_id, (None,))[0] == user_id:
+            del self.__holds[timeslot_id]
+
+    @stats.timed("timeslots.book")
+    def book(self, timeslot_id: str, booking: Booking):
+        user_id = booking.user_id
+        if self.has_booking(user_id) or not self.is_available(timeslot_id, user_id):
+            stats.increment("timeslots.book_conflicts")
+            return False
+
+        self.release(user_id)
+        timeslot = self.__by_id[timeslot_id]
+        timeslot.booking = booking
+        self.__by_booker[user_id] = timeslot
+        self.__discard_open(timeslot)
+        try:
+            self.timeslots.claim({timeslot_id: timeslot}, unset="booking")
+        except StoreConflict:
+            # Another process changed the timeslot first, like booking it. The store reloaded and reindexed.
+            stats.increment("timeslots.book_conflicts")
+            return False
+        try:
+            self.timmies.clear(user_id)
+        except StoreConflict:
+            # The booking is made, another process changed the user's timmie entry first. Leave it, the user can
+            # still only book once.
+            _log.warning(f"Failed to clear the instructors of timmie {user_id} after booking {timeslot_id}")
+        return timeslot
+
+    def get(self, timeslot_id: str):
+        # The timeslot with the ID, None if there is no such timeslot
+        return self.__by_id.get(timeslot_id)
+
+    @stats.timed("timeslots.exists")
     def exists(self, timeslot_id: str):
-        return any([timeslot for timeslot in self.timeslots.data if timeslot["id"] == timeslot_id])
-    
-    def __cleanup(self):
-        # Remove any expired timeslots
-        current_time = datetime.datetime.now()
-        self.timeslots.data = [timeslot for timeslot in self.timeslots.data if current_time.timestamp() - timeslot["time"] <= datetime.timedelta(minutes=10).total_seconds()]
\ No newline at end of file
+        return timeslot_id in self.__by_id
+
+    @stats.timed("timeslots.expire")
+    def expire(self, now: float = None):
+        # Archive the timeslots that are due, evict them and persist once, returns the evicted timeslots
+        now = time.time() if now is None else now
+        if not self.__expiry or self.__expiry[0][0] > now:
+            return []
+
+        # Every process sharing the data expires timeslots, under the lock only the first one archives them and the
+        # others find them gone after the reload
+        expired = []
+        with self.timeslots.locked():
+            while self.__expiry and self.__expiry[0][0] <= now:
+                expires_at, timeslot_id = heapq.heappop(self.__expiry)
+                timeslot = self.__by_id.get(timeslot_id)
+                if timeslot is None or timeslot.time + self.expire_after != expires_at:
+                    continue
+                self.__unindex(timeslot)
+                self.timeslots.data.remove(timeslot)
+                expired.append(timeslot)
+
+            if expired:
+                self.archive.append(expired)
+                self.timeslots.sync({timeslot.id: None for timeslot in expired})
+        return expired
+
+    def next_expiry(self):
+        # When the next timeslot is due to expire, None if there are no timeslots
+        while self.__expiry:
+            expires_at, timeslot_id = self.__expiry[0]
+            timeslot = self.__by_id.get(timeslot_id)
+            if timeslot is not None and timeslot.time + self.expire_after == expires_at:
+                return expires_at
+            heapq.heappop(self.__expiry)
+        return None
+
+    def __held_by_other(self, timeslot_id: str, user_id: int):
+        hold = self.__holds.get(timeslot_id)
+        if hold is None:
+            return False
+        if hold[1] < time.time():
+            # The hold ran out
+            del self.__holds[timeslot_id]
+            if self.__held_by.get(hold[0]) == timeslot_id:
+                del self.__held_by[hold[0]]
+            return False
+        return hold[0] != user_id
+
+    def __cutoff(self):
+        # Timeslots that started before this time are expired
+        return time.time() - self.expire_after
+
+    def __index(self, timeslot: Timeslot, ordered: bool = True):
+        # With ordered set to False the time list and expiry heap are left for the caller to sort in one go
+        self.__by_id[timeslot.id] = timeslot
+        self.__by_instructor.setdefault(timeslot.instructor, {})[timeslot.id] = timeslot
+        if timeslot.booking:
+            self.__by_booker[timeslot.booking.user_id] = timeslot
+        else:
+            open_times = self.__open_by_instructor.setdefault(timeslot.instructor, [])
+            if ordered:
+                insort(open_times, (timeslot.time, timeslot.id))
+            else:
+                open_times.append((timeslot.time, timeslot.id))
+        if ordered:
+            insort(self.__by_time, (timeslot.time, timeslot.id))
+            heapq.heappush(self.__expiry, (timeslot.time + self.expire_after, timeslot.id))
+        else:
+            self.__by_time.append((timeslot.time, timeslot.id))
+            self.__expiry.append((timeslot.time + self.expire_after, timeslot.id))
+
+    def __unindex(self, timeslot: Timeslot):
+        del self.__by_id[timeslot.id]
+        self.ids.free(timeslot.id)
+        hold = self.__holds.pop(timeslot.id, None)
+        if hold is not None and self.__held_by.get(hold[0]) == timeslot.id:
+            del self.__held_by[hold[0]]
+
+        instructor_timeslots = self.__by_instructor[timeslot.instructor]
+        del instructor_timeslots[timeslot.id]
+        if not instructor_timeslots:
+            del self.__by_instructor[timeslot.instructor]
+
+        if timeslot.booking and self.__by_booker.get(timeslot.booking.user_id) is timeslot:
+            del self.__by_booker[timeslot.booking.user_id]
+        self.__discard_open(timeslot)
+
+        self.__discard_time(self.__by_time, timeslot)
+
+    def __discard_open(self, timeslot: Timeslot):
+        open_times = self.__open_by_instructor.get(timeslot.instructor)
+        if open_times is not None:
+            self.__discard_time(open_times, timeslot)
+            if not open_times:
+                del self.__open_by_instructor[timeslot.instructor]
+
+    @staticmethod
+    def __discard_time(times: list, timeslot: Timeslot):
+        position = bisect_left(times, (timeslot.time, timeslot.id))
+        if position < len(times) and times[position] == (timeslot.time, timeslot.id):
+            del times[position]
+
+    def __reindex(self):
+        self.__by_id = {}
+        self.__by_booker = {}
+        self.__by_instructor = {}
+        self.__open_by_instructor = {}
+        self.__by_time = []
+        self.__expiry = []
+        for timeslot in self.timeslots.data:
+            self.__index(timeslot, ordered=False)
+        self.__by_time.sort()
+        for open_times in self.__open_by_instructor.values():
+            open_times.sort()
+        heapq.heapify(self.__expiry)
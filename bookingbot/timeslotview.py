@@ -0,0 +1,71 @@
+from typing import Callable, Iterable
+
+import discord
+
+
+class TimeslotView(discord.ui.View):
+    # Shows a listing of timeslots one page at a time, with buttons to go to the previous and next page
+    # Lines are rendered from the timeslots only when the page they're on is shown for the first time
+
+    def __init__(self, title: str, timeslots: Iterable[dict], render: Callable[[dict], str], page_length: int = 1900, *args, **kwargs) -> None:
+        super().__init__(*args, timeout=kwargs.pop("timeout", 300), **kwargs)
+
+        self.__title = title
+        self.__lines = (render(timeslot) for timeslot in timeslots)
+        self.__next_line = next(self.__lines, None)
+        self.__page_length = page_length
+        self.__pages = []
+        self.__page = 0
+
+        self.__page_content(0)
+        self.__update_buttons()
+
+    @property
+    def empty(self):
+        return not self.__pages[0]
+
+    @property
+    def paginated(self):
+        # Whether there is more than one page, a single page doesn't need the buttons
+        return len(self.__pages) > 1 or self.__next_line is not None
+
+    @property
+    def content(self):
+        return self.__render_page(self.__page)
+
+    def __page_content(self, number: int):
+        # Render pages until the requested one exists, returns None if there aren't that many pages
+        while len(self.__pages) <= number:
+            if self.__next_line is None and self.__pages:
+                return None
+
+            lines = []
+            length = 0
+            while self.__next_line is not None and (not lines or length + len(self.__next_line) + 1 <= self.__page_length):
+                lines.append(self.__next_line)
+                length += len(self.__next_line) + 1
+                self.__next_line = next(self.__lines, None)
+            self.__pages.append(lines)
+        return self.__pages[number]
+
+    def __render_page(self, number: int):
+        header = self.__title if not self.paginated else f"{self.__title} (page {number + 1})"
+        return header + "\n" + "".join(line + "\n" for line in self.__pages[number])
+
+    def __update_buttons(self):
+        self.previous.disabled = self.__page == 0
+        self.next.disabled = self.__page + 1 >= len(self.__pages) and self.__next_line is None
+
+    async def __show(self, interaction: discord.Interaction, number: int):
+        if self.__page_content(number) is not None:
+            self.__page = number
+        self.__update_buttons()
+        await interaction.response.edit_message(content=self.content, view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.__show(interaction, max(0, self.__page - 1))
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await self.__show(interaction, self.__page + 1)
@@ -1,38 +1,85 @@
 
+from bookingbot.records import user_id
 from bookingbot.store import Store
 
 
 class Timmie:
-    
-    def __init__(self):
-        self.timmies = Store[dict](f"data/timmie.json", {})
-        
-    def add(self, timmie_id: str, instructor_id: str):
+    # Keeps track of which instructors a timmie can book with
+    # The store holds {timmie_id: [instructor_id, ...]}, in memory both directions are kept as sets
+    # The IDs are ints, also the timmie IDs that the JSON file has as string keys
+
+    def __init__(self, directory: str = "data"):
+        self.timmies = Store[dict](f"{directory}/timmie.json", {}, key_type=user_id,
+                                  decode=lambda instructors: [user_id(instructor) for instructor in instructors],
+                                  on_reload=lambda: self.__reindex())
+        self.__reindex()
+
+    def add(self, timmie_id: int, instructor_id: int):
         if not self.timmies.data.get(timmie_id):
             self.timmies.data[timmie_id] = []
-            
-        if instructor_id in self.timmies.data[timmie_id]:
+
+        if instructor_id in self.__instructors.get(timmie_id, ()):
             return
-        
+
         self.timmies.data[timmie_id].append(instructor_id)
-        self.timmies.sync()
-        
-    def remove(self, timmie_id: str, instructor_id: str):
+        self.__link(timmie_id, instructor_id)
+        self.timmies.sync({timmie_id: self.timmies.data[timmie_id]})
+
+    def add_many(self, pairs):
+        # Add (timmie_id, instructor_id) pairs with a single sync, returns how many were new
+        changes = {}
+        added = 0
+        for timmie_id, instructor_id in pairs:
+            if instructor_id in self.__instructors.get(timmie_id, ()):
+                continue
+
+            added += 1
+            changes[timmie_id] = self.timmies.data.setdefault(timmie_id, [])
+            changes[timmie_id].append(instructor_id)
+            self.__link(timmie_id, instructor_id)
+
+        if changes:
+            self.timmies.sync(changes)
+        return added
+
+    def remove(self, timmie_id: int, instructor_id: int):
         if not self.timmies.data.get(timmie_id):
             return
-        
+
         self.timmies.data[timmie_id] = [instructor for instructor in self.timmies.data[timmie_id] if instructor != instructor_id]
-        self.timmies.sync()
-        
-    def clear(self, timmie_id: str):
+        self.__unlink(timmie_id, instructor_id)
+        self.timmies.sync({timmie_id: self.timmies.data[timmie_id]})
+
+    def clear(self, timmie_id: int):
         if not self.timmies.data.get(timmie_id):
             return
-        
+
+        for instructor_id in self.timmies.data[timmie_id]:
+            self.__unlink(timmie_id, instructor_id)
         del self.timmies.data[timmie_id]
-        self.timmies.sync()
-        
-    def list_instructors(self, timmie_id: str):
-        return self.timmies.data.get(timmie_id, [])
-    
-    def list_timmies(self, instructor_id: str):
-        return [timmie_id for timmie_id, instructors in self.timmies.data.items() if instructor_id in instructors]
\ No newline at end of file
+        self.timmies.sync({timmie_id: None})
+
+    def list_instructors(self, timmie_id: int):
+        return self.__instructors.get(timmie_id, set())
+
+    def list_timmies(self, instructor_id: int):
+        return self.__timmies.get(instructor_id, set())
+
+    def __link(self, timmie_id: int, instructor_id: int):
+        self.__instructors.setdefault(timmie_id, set()).add(instructor_id)
+        self.__timmies.setdefault(instructor_id, set()).add(timmie_id)
+
+    def __unlink(self, timmie_id: int, instructor_id: int):
+        for index, key, value in ((self.__instructors, timmie_id, instructor_id), (self.__timmies, instructor_id, timmie_id)):
+            values = index.get(key)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del index[key]
+
+    def __reindex(self):
+        self.__instructors = {}
+        self.__timmies = {}
+        for timmie_id, instructors in self.timmies.data.items():
+            for instructor_id in instructors:
+                self.__link(timmie_id, instructor_id)
@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from bookingbot.announcements import Announcer
+
+class AnnouncerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.channel = MagicMock()
+        self.channel.send = AsyncMock()
+        self.bot = MagicMock()
+        self.bot.get_channel.return_value = self.channel
+
+    async def wait_for_sends(self, count):
+        for _ in range(200):
+            if self.channel.send.await_count >= count:
+                return
+            await asyncio.sleep(0.005)
+
+    async def test_digest(self):
+        announcer = Announcer(self.bot, window=0.02)
+        announcer.start()
+        for number in range(3):
+            announcer.announce(1, f"- {number}")
+        await self.wait_for_sends(1)
+        announcer.stop()
+        self.channel.send.assert_awaited_once_with("Timeslots booked (3):\n- 0\n- 1\n- 2\n")
+
+    async def test_rate_limit_merges(self):
+        announcer = Announcer(self.bot, window=0, burst=1, rate=20)
+        announcer.start()
+        announcer.announce(1, "- 0")
+        await self.wait_for_sends(1)
+        # The bucket is empty, these wait for the next token and go out together
+        announcer.announce(1, "- 1")
+        await asyncio.sleep(0)
+        announcer.announce(1, "- 2")
+        await self.wait_for_sends(2)
+        announcer.stop()
+        self.assertEqual(self.channel.send.await_args_list[1].args, ("Timeslots booked (2):\n- 1\n- 2\n",))
+
+    async def test_retry(self):
+        self.channel.send.side_effect = [Exception("rate limited"), None]
+        announcer = Announcer(self.bot, window=0, backoff=0.01)
+        announcer.start()
+        announcer.announce(1, "- 0")
+        await self.wait_for_sends(2)
+        announcer.stop()
+        self.assertEqual(self.channel.send.await_args.args, ("Timeslot booked: \n- 0\n",))
+        self.assertEqual(announcer.pending, 0)
+
+    async def test_gives_up_on_the_digest_only(self):
+        self.channel.send.side_effect = [Exception("forbidden"), Exception("forbidden"), None]
+        announcer = Announcer(self.bot, window=0, backoff=0.01, max_attempts=2, page_length=5)
+        for number in range(2):
+            announcer.announce(1, f"- {number}")
+        announcer.start()
+        await self.wait_for_sends(3)
+        announcer.stop()
+        # The first digest was dropped, the line that didn't fit in it still went out
+        self.assertEqual(self.channel.send.await_args.args, ("Timeslot booked: \n- 1\n",))
+        self.assertEqual(announcer.pending, 0)
+
+    async def test_split_and_flush(self):
+        announcer = Announcer(self.bot, page_length=10)
+        for number in range(3):
+            announcer.announce(1, f"- {number}")
+        await announcer.flush()
+        self.assertEqual(self.channel.send.await_count, 2)
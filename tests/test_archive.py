@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from bookingbot.archive import Archive
+from bookingbot.records import Booking, Timeslot
+from bookingbot.store import Store
+from bookingbot.timeslots import Timeslots
+
+class ArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = Archive(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_history(self):
+        self.archive.append([Timeslot("1", 1000.0, 10, Booking(20, "got")), Timeslot("2", 2000.0, 11)])
+        self.archive.append([Timeslot("3", 3000.0, 10), Timeslot("4", 4000.0, 11, Booking(20, "got"))])
+        self.assertEqual([timeslot.id for timeslot in self.archive.history(instructor=10)], ["1", "3"])
+        self.assertEqual([timeslot.id for timeslot in self.archive.history(user_id=20)], ["1", "4"])
+        self.assertEqual(list(self.archive.history(instructor=12)), [])
+        # Only the members of instructor 10 are indexed for it
+        self.assertEqual(len(self.archive.index.data["instructor:10"]), 2)
+        self.assertEqual(len(self.archive.index.data["user:20"]), 2)
+
+    def test_segments_and_reload(self):
+        self.archive.segment_size = 1
+        self.archive.append([Timeslot("1", 1000.0, 10)])
+        self.archive.append([Timeslot("2", 2000.0, 10)])
+        self.assertTrue(os.path.exists(self.archive.segment_file(2)))
+
+        reloaded = Archive(self.directory.name)
+        reloaded.segment_size = 1
+        reloaded.append([Timeslot("3", 3000.0, 10)])
+        self.assertTrue(os.path.exists(reloaded.segment_file(3)))
+        self.assertEqual([timeslot.id for timeslot in reloaded.history(instructor=10)], ["1", "2", "3"])
+
+    def test_recent_ids_survive_a_restart(self):
+        timeslots = Timeslots(MagicMock(), self.directory.name)
+        timeslots.add(Timeslot("aaaaa", 1000.0, 10))
+        timeslots.expire()
+
+        restarted = Timeslots(MagicMock(), self.directory.name)
+        self.assertEqual([identifier for identifier, _ in restarted.archive.recent_ids()], ["aaaaa"])
+        self.assertFalse(restarted.ids.is_free("aaaaa"))
+
+        # Only the IDs of the last recent_period seconds are kept
+        restarted.archive.recent_period = 0
+        restarted.archive.append([Timeslot("ccccc", 2000.0, 10)])
+        self.assertEqual([identifier for identifier, _ in restarted.archive.recent_ids()], ["ccccc"])
+
+    @patch.object(Store, "defaults", {"shared": True})
+    def test_shared_expiry_archives_once(self):
+        first = Timeslots(MagicMock(), self.directory.name)
+        first.add(Timeslot("1", 1000.0, 10, Booking(20)))
+        second = Timeslots(MagicMock(), self.directory.name)
+        self.assertEqual([timeslot.id for timeslot in first.expire()], ["1"])
+        # The second process finds the timeslot already archived instead of archiving it again
+        self.assertEqual(second.expire(), [])
+        self.assertEqual(second.list(), [])
+        # Like Guilds.get refreshes the stores of a guild
+        second.archive.index.refresh()
+        self.assertEqual([timeslot.id for timeslot in second.archive.history(user_id=20)], ["1"])
+
@@ -0,0 +1,35 @@
+import unittest
+from bookingbot.autocomplete import AutocompleteIndex
+
+class AutocompleteIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = AutocompleteIndex({
+            "America/New_York": "America/New_York",
+            "Europe/Amsterdam": "Europe/Amsterdam",
+            "Europe/Berlin": "Europe/Berlin",
+            "Asia/Samarkand": "Asia/Samarkand",
+        }, limit=3)
+
+    def test_empty_query_returns_first_options(self):
+        self.assertEqual(self.index.search(""), ["America/New_York", "Europe/Amsterdam", "Europe/Berlin"])
+
+    def test_word_prefix_matches_first(self):
+        self.assertEqual(self.index.search("am"), ["America/New_York", "Europe/Amsterdam", "Asia/Samarkand"])
+        self.assertEqual(self.index.search("sam"), ["Asia/Samarkand"])
+
+    def test_substring_and_normalization(self):
+        self.assertEqual(self.index.search("NEW_YORK"), ["America/New_York"])
+        self.assertEqual(self.index.search("pe/b"), ["Europe/Berlin"])
+        self.assertEqual(self.index.search("xyz"), [])
+
+    def test_results_are_copies(self):
+        self.index.search("e").clear()
+        self.assertTrue(self.index.search("e"))
+
+    def test_lookup(self):
+        index = AutocompleteIndex({"Netherlands": "NL"})
+        self.assertEqual(index.lookup("Netherlands"), "NL")
+        self.assertIsNone(index.lookup("Atlantis"))
+
+if __name__ == "__main__":
+    unittest.main()
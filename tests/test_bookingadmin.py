@@ -0,0 +1,116 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import bookingadmin
+from bookingbot.guilds import Guild
+
+class BookingAdminTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.guild = Guild(1, self.directory.name)
+        self.errors = io.StringIO()
+
+    def tearDown(self):
+        self.guild.close()
+        self.directory.cleanup()
+
+    def import_csv(self, kind: str, content: str, **options):
+        rows = bookingadmin.read_rows(io.StringIO(content), "csv")
+        return bookingadmin.import_rows(self.guild, kind, rows, errors=self.errors, **options)
+
+    def test_import_timeslots(self):
+        applied, invalid = self.import_csv("timeslots", "id,time,instructor,user_id,got_username,meta_username\n"
+                                                        "aaaaa,2099-01-01T10:00:00+00:00,10,,,\n"
+                                                        ",4102480800,10,20,got,meta\n")
+        self.assertEqual((applied, invalid), (2, 0))
+        booked = self.guild.timeslots.list(10)[1]
+        self.assertEqual(booked.time, 4102480800)
+        self.assertEqual((booked.booking.user_id, booked.booking.got_username), (20, "got"))
+        self.assertTrue(self.guild.timeslots.has_booking(20))
+
+    def test_invalid_rows_import_nothing(self):
+        content = ("id,time,instructor\n"
+                   "aaaaa,4102480800,10\n"
+                   "aaaaa,4102484400,10\n"
+                   "bbbbb,2099-01-01T10:00:00,10\n"
+                   "ccccc,1000,10\n"
+                   "ddddd,4102480800,someone\n")
+        self.assertEqual(self.import_csv("timeslots", content), (0, 4))
+        self.assertEqual(self.guild.timeslots.list(), [])
+        self.assertEqual([line.split(":")[0] for line in self.errors.getvalue().splitlines()], ["line 3", "line 4", "line 5", "line 6"])
+
+        self.assertEqual(self.import_csv("timeslots", content, skip_invalid=True), (1, 4))
+        self.assertEqual([timeslot.id for timeslot in self.guild.timeslots.list()], ["aaaaa"])
+
+    def test_import_is_one_write(self):
+        self.guild.timmies.timmies.sync = MagicMock()
+        self.assertEqual(self.import_csv("timmies", "timmie,instructor\n1,10\n1,11\n2,10\n"), (3, 0))
+        self.guild.timmies.timmies.sync.assert_called_once()
+        self.assertEqual(self.guild.timmies.list_timmies(10), {1, 2})
+
+    def test_import_settings_jsonl(self):
+        content = '{"user_id": 1, "timezone": "Europe/Amsterdam", "locale": "NL"}\n\n{"user_id": 2, "locale": "XX"}\n'
+        rows = bookingadmin.read_rows(io.StringIO(content), "jsonl")
+        self.assertEqual(bookingadmin.import_rows(self.guild, "settings", rows, skip_invalid=True, errors=self.errors), (1, 1))
+        self.assertIn("line 3: unknown locale 'XX'", self.errors.getvalue())
+        self.assertEqual(self.guild.settings.get_timezone(1), "Europe/Amsterdam")
+
+    def test_export_round_trip(self):
+        self.import_csv("timeslots", "id,time,instructor,user_id\naaaaa,4102480800,10,20\nbbbbb,4102484400,10,\n")
+        output = io.StringIO()
+        rows = bookingadmin.export_rows(self.guild, "timeslots", "jsonl")
+        self.assertEqual(bookingadmin.write_rows(rows, "timeslots", "jsonl", output), 2)
+        self.assertEqual(json.loads(output.getvalue().splitlines()[0])["booking"]["user_id"], 20)
+
+        csv = io.StringIO()
+        bookingadmin.write_rows(bookingadmin.export_rows(self.guild, "timeslots", "csv"), "timeslots", "csv", csv)
+        self.assertEqual(csv.getvalue().splitlines()[1], "aaaaa,2100-01-01T10:00:00+00:00,10,20,,")
+
+        other = Guild(2, os.path.join(self.directory.name, "other"))
+        rows = bookingadmin.read_rows(io.StringIO(output.getvalue()), "jsonl")
+        self.assertEqual(bookingadmin.import_rows(other, "timeslots", rows, errors=self.errors), (2, 0))
+        self.assertEqual([timeslot.to_json() for timeslot in other.timeslots.list()],
+                         [timeslot.to_json() for timeslot in self.guild.timeslots.list()])
+        other.close()
+
+    def test_export_to_stdout_has_only_rows(self):
+        directory = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(directory.name)
+        try:
+            with patch("sys.stdout", new=io.StringIO()) as stdout, patch("sys.stderr", new=io.StringIO()):
+                self.assertEqual(bookingadmin.main(["--guild", "5", "export", "timmies", "--format", "csv"]), 0)
+        finally:
+            os.chdir(cwd)
+            directory.cleanup()
+        self.assertEqual(stdout.getvalue().splitlines(), ["timmie,instructor"])
+
+    def test_data_directory_in_sqlite_mode(self):
+        directory = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(directory.name)
+        defaults = bookingadmin.Store.defaults
+        try:
+            with open("timmies.csv", "w") as file:
+                file.write("timmie,instructor\n10,20\n")
+            with patch.dict(os.environ, {"BOOKINGBOT_STORAGE": "sqlite"}), patch("sys.stderr", new=io.StringIO()):
+                self.assertEqual(bookingadmin.main(["--guild", "5", "--data", "elsewhere", "import", "timmies", "timmies.csv"]), 0)
+            self.assertFalse(os.path.exists("data"))
+            guild = Guild(5, "elsewhere/guilds/5")
+            self.assertEqual(guild.timmies.list_instructors(10), {20})
+            guild.close()
+            connection = sqlite3.connect(os.path.join("elsewhere", "bookingbot.db"))
+            self.assertEqual(connection.execute('SELECT key, value FROM "guilds_5_timmie"').fetchall(), [("10", "[20]")])
+            connection.close()
+        finally:
+            bookingadmin.Store.configure(**defaults)
+            os.chdir(cwd)
+            directory.cleanup()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from bookingbot.guilds import Guild, Guilds
+from bookingbot.records import Booking, Timeslot
+
+class GuildsTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory.name)
+        os.makedirs("data")
+        self.guilds = Guilds(capacity=2, legacy_guild=1, legacy_announcement_channel=100)
+
+    def tearDown(self):
+        self.guilds.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_partitions(self):
+        self.guilds.get(1).timmies.add(10, 20)
+        self.guilds.get(2).timmies.add(11, 21)
+        self.assertTrue(os.path.exists("data/timmie.json"))
+        self.assertTrue(os.path.exists("data/guilds/2/timmie.json"))
+        self.assertEqual(self.guilds.get(1).timmies.list_instructors(11), set())
+
+    def test_stored_timeslots(self):
+        self.guilds.get(1)
+        self.guilds.get(2).timeslots.add(Timeslot("a", time.time() + 3600, 10, Booking(20)))
+        self.guilds.close()
+        os.makedirs("data/guilds/not-a-guild")
+        self.assertEqual(sorted(self.guilds.stored()), [1, 2])
+        self.assertEqual([timeslot.id for timeslot in self.guilds.stored_timeslots(2)], ["a"])
+        self.assertEqual(self.guilds.loaded(), [])
+
+    def test_evicts_least_recently_used(self):
+        first = self.guilds.get(2)
+        first.timmies.add(10, 20)
+        self.guilds.get(3)
+        self.guilds.get(2)
+        self.guilds.get(4)
+        self.assertEqual([guild.id for guild in self.guilds.loaded()], [2, 4])
+
+        self.guilds.get(5)
+        self.guilds.get(6)
+        reloaded = self.guilds.get(2)
+        self.assertIsNot(reloaded, first)
+        self.assertEqual(reloaded.timmies.list_instructors(10), {20})
+
+    def test_announcement_channel(self):
+        self.assertEqual(self.guilds.get(1).announcement_channel, 100)
+        self.assertIsNone(self.guilds.get(2).announcement_channel)
+
+        self.guilds.get(2).set_announcement_channel(200)
+        self.guilds.close()
+        self.assertEqual(self.guilds.get(2).announcement_channel, 200)
+
+    def test_preload(self):
+        self.guilds.preload(2).join()
+        self.assertEqual([guild.id for guild in self.guilds.loaded()], [2])
+        self.assertIs(self.guilds.get(2), self.guilds.loaded()[0])
+
+    def test_loading_only_blocks_that_guild(self):
+        first = self.guilds.get(2)
+        release = threading.Event()
+
+        def slow_guild(guild_id, *args):
+            if guild_id == 3:
+                release.wait(5)
+            return Guild(guild_id, *args)
+
+        with patch("bookingbot.guilds.Guild", side_effect=slow_guild) as guild_class:
+            thread = self.guilds.preload(3)
+            waiting = threading.Thread(target=self.guilds.get, args=(3,))
+            waiting.start()
+            # While guild 3 loads the loaded guilds can still be used
+            self.assertIs(self.guilds.get(2), first)
+            self.assertEqual([guild.id for guild in self.guilds.loaded()], [2])
+            release.set()
+            thread.join()
+            waiting.join()
+        self.assertEqual([guild.id for guild in self.guilds.loaded()], [2, 3])
+        # The get that came in during the preload waited for it instead of loading the guild again
+        self.assertEqual([call.args[0] for call in guild_class.call_args_list], [3])
+
+    def test_on_load_sees_the_guild_loaded(self):
+        loaded = []
+        self.guilds.on_load = lambda guild: loaded.append([other.id for other in self.guilds.loaded()])
+        self.guilds.get(2)
+        self.assertEqual(loaded, [[2]])
+
+    def test_wait_for_doesnt_block_the_loop(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_guild(guild_id, *args):
+            started.set()
+            release.wait(5)
+            return Guild(guild_id, *args)
+
+        async def command():
+            ticks = 0
+            waiting = asyncio.ensure_future(self.guilds.wait_for(3))
+            while not waiting.done():
+                ticks += 1
+                if ticks == 3:
+                    release.set()
+                await asyncio.sleep(0.01)
+            return ticks
+
+        with patch("bookingbot.guilds.Guild", side_effect=slow_guild):
+            thread = self.guilds.preload(3)
+            started.wait(5)
+            # The loop kept running while the guild loaded
+            self.assertGreaterEqual(asyncio.run(command()), 3)
+            thread.join()
+        self.assertEqual([guild.id for guild in self.guilds.loaded()], [3])
+
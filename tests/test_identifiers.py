@@ -0,0 +1,38 @@
+import random
+import unittest
+from bookingbot.identifiers import IdAllocator
+
+class IdAllocatorTests(unittest.TestCase):
+    def setUp(self):
+        self.live = set()
+        self.ids = IdAllocator(self.live.__contains__, random.Random(1))
+
+    def test_allocate(self):
+        identifier = self.ids.allocate()
+        self.assertEqual(len(identifier), 5)
+        self.assertFalse(set(identifier) & set("oO0"))
+        # Handed out but not added yet
+        self.assertFalse(self.ids.is_free(identifier))
+
+    def test_bulk_allocation_is_unique(self):
+        identifiers = self.ids.allocate(1000)
+        self.assertEqual(len(set(identifiers)), 1000)
+        self.assertTrue(set(identifiers).isdisjoint(self.ids.allocate(1000)))
+
+    def test_skips_live_ids(self):
+        first = IdAllocator(self.live.__contains__, random.Random(2)).allocate()
+        self.live.add(first)
+        self.assertNotEqual(IdAllocator(self.live.__contains__, random.Random(2)).allocate(), first)
+
+    def test_freed_ids_come_back_after_grace(self):
+        identifier = self.ids.allocate()
+        self.ids.free(identifier)
+        self.assertFalse(self.ids.is_free(identifier))
+        self.assertTrue(self.ids.is_free(identifier, 1e12))
+
+    def test_crowded_space_gets_longer_ids(self):
+        ids = IdAllocator(lambda identifier: len(identifier) == 5)
+        self.assertEqual(len(ids.allocate()), 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import datetime
+import unittest
+import pytz
+from bookingbot import recurrence
+
+class RecurrenceTests(unittest.TestCase):
+    def test_parse_days(self):
+        self.assertEqual(recurrence.parse_days("weekdays"), {0, 1, 2, 3, 4})
+        self.assertEqual(recurrence.parse_days("Mon, wednesday,fri"), {0, 2, 4})
+        with self.assertRaises(ValueError):
+            recurrence.parse_days("someday")
+        with self.assertRaises(ValueError):
+            recurrence.parse_days(",")
+
+    def test_occurrences(self):
+        timezone = pytz.timezone("Europe/Amsterdam")
+        # Monday 20:00
+        current_time = timezone.localize(datetime.datetime(2024, 3, 18, 20, 0))
+        start_times = list(recurrence.occurrences(timezone, current_time, [(21, 0), (18, 0)], {0, 2}, 2))
+        self.assertEqual([start_time.strftime("%a %d %H:%M") for start_time in start_times],
+                         ["Mon 18 21:00", "Wed 20 18:00", "Wed 20 21:00", "Mon 25 18:00", "Mon 25 21:00", "Wed 27 18:00", "Wed 27 21:00"])
+
+    def test_occurrences_across_daylight_saving(self):
+        timezone = pytz.timezone("Europe/Amsterdam")
+        current_time = timezone.localize(datetime.datetime(2024, 3, 30, 12, 0))
+        saturday, sunday = recurrence.occurrences(timezone, current_time, [(18, 0)], {5, 6}, 1)
+        self.assertEqual(sunday.timestamp() - saturday.timestamp(), 23 * 3600)
+        self.assertEqual(sunday.hour, 18)
+
+if __name__ == "__main__":
+    unittest.main()
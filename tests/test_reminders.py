@@ -0,0 +1,61 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from bookingbot.records import Booking, Timeslot
+from bookingbot.reminders import Reminders
+
+class RemindersTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.user = MagicMock()
+        self.user.send = AsyncMock()
+        self.bot = MagicMock()
+        self.bot.get_or_fetch_user = AsyncMock(return_value=self.user)
+        self.timeslots = {}
+        self.guilds = MagicMock()
+        self.guilds.get.return_value.timeslots.get.side_effect = self.timeslots.get
+        self.guilds.wait_for = AsyncMock()
+        self.reminders = Reminders(self.bot, offsets=(3600, 600))
+
+    def test_schedule_once(self):
+        timeslot = Timeslot("1", 10_000.0, 10, Booking(20))
+        self.reminders.schedule(1, timeslot, now=0)
+        self.reminders.schedule(1, timeslot, now=0)
+        self.assertEqual(self.reminders.pending, 2)
+        # Offsets that already passed are skipped
+        self.reminders.schedule(1, Timeslot("2", 10_000.0, 10, Booking(21)), now=9_000)
+        self.assertEqual(self.reminders.pending, 3)
+        self.assertEqual([reminder[2:] for reminder in self.reminders.due(now=9_000)], [("1", 3600)])
+
+    def test_schedule_guild(self):
+        guild = MagicMock()
+        guild.id = 1
+        guild.timeslots.list.return_value = [Timeslot("1", time.time() + 7200, 10, Booking(20)), Timeslot("2", time.time() + 7200, 10)]
+        self.reminders.schedule_guild(guild)
+        self.assertEqual(self.reminders.pending, 2)
+
+    def test_schedule_stored(self):
+        loaded = MagicMock()
+        loaded.id = 1
+        self.guilds.loaded.return_value = [loaded]
+        self.guilds.stored.return_value = [1, 2]
+        self.guilds.stored_timeslots.return_value = [Timeslot("1", time.time() + 7200, 10, Booking(20))]
+        self.reminders.guilds = self.guilds
+        self.reminders.schedule_stored()
+        self.guilds.stored_timeslots.assert_called_once_with(2)
+        self.assertEqual([reminder[1] for reminder in self.reminders.due(now=time.time() + 7200)], [2, 2])
+
+    async def test_sends_due_reminders(self):
+        booked = Timeslot("1", time.time() + 600.05, 10, Booking(20))
+        removed = Timeslot("2", time.time() + 600.05, 10, Booking(21))
+        self.timeslots["1"] = booked
+        self.reminders.start(self.guilds)
+        self.reminders.schedule(1, booked)
+        self.reminders.schedule(1, removed)
+        for _ in range(100):
+            if self.user.send.await_count >= 2:
+                break
+            await asyncio.sleep(0.01)
+        self.reminders.stop()
+        self.assertEqual([call.args[0] for call in self.bot.get_or_fetch_user.await_args_list], [20, 10])
+        self.assertEqual(self.reminders.pending, 0)
@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import MagicMock
+from bookingbot.settings import Settings
+
+class SettingsTests(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.store = MagicMock()
+        self.settings.store.data = {}
+
+    def test_profile_defaults(self):
+        profile = self.settings.get_profile(1)
+        self.assertIsNone(profile.timezone)
+        self.assertIsNone(profile.locale)
+        self.assertFalse(profile.month_first)
+        self.assertEqual(profile.date_format, "DD/MM")
+
+    def test_profile_resolves_settings(self):
+        self.settings.set_timezone(1, "America/New_York")
+        self.settings.set_locale(1, "US")
+        profile = self.settings.get_profile(1)
+        self.assertEqual(profile.timezone.zone, "America/New_York")
+        self.assertEqual(profile.locale.territory, "US")
+        self.assertTrue(profile.month_first)
+        self.assertEqual(profile.date_format, "MM/DD")
+        self.assertTrue(self.settings.is_month_first("1"))
+
+    def test_profile_is_cached_and_invalidated(self):
+        self.settings.set_locale(1, "NL")
+        profile = self.settings.get_profile(1)
+        self.assertIs(self.settings.get_profile("1"), profile)
+        self.assertFalse(profile.month_first)
+
+        self.settings.set_locale(1, "US")
+        self.assertIsNot(self.settings.get_profile(1), profile)
+        self.assertTrue(self.settings.is_month_first(1))
+
+    def test_set_many(self):
+        self.settings.set_locale(1, "NL")
+        self.assertFalse(self.settings.is_month_first(1))
+        self.assertEqual(self.settings.set_many([(1, {"locale": "US"}), (2, {"timezone": "UTC"})]), 2)
+        self.assertTrue(self.settings.is_month_first(1))
+        self.assertEqual(self.settings.get_timezone(2), "UTC")
+        self.settings.store.sync.assert_called_with({"1": {"locale": "US"}, "2": {"timezone": "UTC"}})
+
+    def test_unknown_timezone(self):
+        self.settings.set_timezone(1, "Nowhere/Special")
+        self.assertIsNone(self.settings.get_profile(1).timezone)
+
+if __name__ == "__main__":
+    unittest.main()
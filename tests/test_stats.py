@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+from bookingbot.stats import Histogram, Stats
+
+class StatsTests(unittest.TestCase):
+    def setUp(self):
+        self.stats = Stats()
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram()
+        for _ in range(98):
+            histogram.observe(0.002)
+        histogram.observe(0.3)
+        histogram.observe(30)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.quantile(0.5), 0.0025)
+        self.assertEqual(histogram.quantile(0.99), 0.5)
+        self.assertEqual(histogram.quantile(1), 5.0)
+
+    def test_timed(self):
+        @self.stats.timed("plain")
+        def plain(value):
+            return value
+
+        @self.stats.timed("coroutine", kind="async")
+        async def coroutine(value):
+            return value
+
+        self.assertEqual(plain(1), 1)
+        self.assertEqual(asyncio.run(coroutine(2)), 2)
+        self.assertEqual(self.stats.histograms[("plain", ())].count, 1)
+        self.assertEqual(self.stats.histograms[("coroutine", (("kind", "async"),))].count, 1)
+
+    def test_prometheus(self):
+        self.stats.observe("store.write", 0.004, store="timeslots")
+        self.stats.increment("store.bytes_written", 120, store="timeslots")
+        text = self.stats.render_prometheus()
+        self.assertIn("# TYPE bookingbot_store_write_seconds histogram", text)
+        self.assertIn('bookingbot_store_write_seconds_bucket{store="timeslots",le="0.0025"} 0', text)
+        self.assertIn('bookingbot_store_write_seconds_bucket{store="timeslots",le="0.005"} 1', text)
+        self.assertIn('bookingbot_store_write_seconds_bucket{store="timeslots",le="+Inf"} 1', text)
+        self.assertIn('bookingbot_store_write_seconds_count{store="timeslots"} 1', text)
+        self.assertIn('bookingbot_store_bytes_written_total{store="timeslots"} 120', text)
+
+    def test_summary(self):
+        self.stats.observe("command", 0.2, command="book")
+        self.stats.observe("command", 0.001, command="timeslots")
+        self.stats.increment("store.syncs")
+        self.assertEqual(self.stats.summary(), [
+            "command{command=book}: 1x, avg 200.0ms, p50 <250ms, p99 <250ms",
+            "command{command=timeslots}: 1x, avg 1.0ms, p50 <1ms, p99 <1ms",
+            "store.syncs: 1",
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from bookingbot.records import Booking, Timeslot
+from bookingbot.store import Store, StoreConflict
+
+class StoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "store.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sync_writes_whole_file(self):
+        store = Store[dict](self.file, {})
+        store.data["1"] = {"timezone": "Europe/Amsterdam"}
+        store.sync()
+        with open(self.file) as file:
+            self.assertEqual(json.load(file), {"1": {"timezone": "Europe/Amsterdam"}})
+        self.assertFalse(os.path.exists(f"{self.file}.tmp"))
+
+    def test_journal_appends_changes(self):
+        store = Store[dict](self.file, {}, journal=True)
+        store.data["1"] = {"timezone": "Europe/Amsterdam"}
+        store.sync({"1": store.data["1"]})
+        self.assertFalse(os.path.exists(self.file))
+        with open(store.journal_file) as file:
+            self.assertEqual(len(file.readlines()), 1)
+
+    def test_journal_replay_dict(self):
+        store = Store[dict](self.file, {}, journal=True)
+        store.data[1] = ["a"]
+        store.sync({1: store.data[1]})
+        store.data[2] = ["b"]
+        store.sync({2: store.data[2]})
+        del store.data[1]
+        store.sync({1: None})
+
+        reloaded = Store[dict](self.file, {}, journal=True)
+        self.assertEqual(reloaded.data, {"2": ["b"]})
+        self.assertFalse(os.path.exists(reloaded.journal_file))
+
+    def test_journal_replay_list(self):
+        store = Store[list](self.file, [], key="id", journal=True)
+        for timeslot_id in ("1", "2", "3"):
+            store.data.append({"id": timeslot_id})
+            store.sync({timeslot_id: store.data[-1]})
+        store.data[1]["booking"] = {"user_id": 5}
+        store.sync({"2": store.data[1]})
+        store.sync({"3": None})
+
+        reloaded = Store[list](self.file, [], key="id", journal=True)
+        self.assertEqual(reloaded.data, [{"id": "1"}, {"id": "2", "booking": {"user_id": 5}}])
+
+    def test_read_only_leaves_the_journal(self):
+        store = Store[dict](self.file, {}, journal=True)
+        store.data["1"] = 1
+        store.sync({"1": 1})
+
+        reloaded = Store[dict](self.file, {}, journal=True, read_only=True)
+        self.assertEqual(reloaded.data, {"1": 1})
+        self.assertTrue(os.path.exists(store.journal_file))
+        self.assertFalse(os.path.exists(self.file))
+
+    def test_journal_ignores_torn_record(self):
+        store = Store[dict](self.file, {}, journal=True)
+        store.data["1"] = 1
+        store.sync({"1": 1})
+        with open(store.journal_file, "a") as file:
+            file.write('{"key": "2", "val')
+
+        reloaded = Store[dict](self.file, {}, journal=True)
+        self.assertEqual(reloaded.data, {"1": 1})
+
+    def test_journal_compaction(self):
+        store = Store[dict](self.file, {}, journal=True, compact_after=3)
+        for key in range(5):
+            store.data[str(key)] = key
+            store.sync({str(key): key})
+        store.wait_for_compaction()
+
+        with open(self.file) as file:
+            self.assertEqual(json.load(file), {"0": 0, "1": 1, "2": 2})
+        self.assertFalse(os.path.exists(f"{store.journal_file}.old"))
+        self.assertEqual(Store[dict](self.file, {}, journal=True).data, {str(key): key for key in range(5)})
+
+    def test_write_behind_coalesces(self):
+        store = Store[dict](self.file, {}, write_behind=True, flush_delay=10)
+        for key in range(100):
+            store.data[str(key)] = key
+            store.sync()
+        self.assertFalse(os.path.exists(self.file))
+        store.wait_for_flush()
+        with open(self.file) as file:
+            self.assertEqual(len(json.load(file)), 100)
+        store.close()
+
+    def test_write_behind_journal(self):
+        store = Store[dict](self.file, {}, journal=True, write_behind=True, flush_delay=10)
+        for key in range(10):
+            store.data[str(key)] = key
+            store.sync({str(key): key})
+        asyncio.run(store.flush())
+        with open(store.journal_file) as file:
+            self.assertEqual(len(file.readlines()), 10)
+        store.close()
+
+    def test_write_behind_close_flushes(self):
+        store = Store[dict](self.file, {}, write_behind=True, flush_delay=10)
+        store.data["1"] = 1
+        store.sync()
+        store.close()
+        self.assertEqual(Store[dict](self.file, {}).data, {"1": 1})
+
+    def test_database_changes(self):
+        database = os.path.join(self.directory.name, "store.db")
+        store = Store[list](self.file, [], key="id", indexes=("instructor",), database=database)
+        store.data.append({"id": "1", "instructor": 1})
+        store.data.append({"id": "2", "instructor": 2})
+        store.sync({"1": store.data[0], "2": store.data[1]})
+        store.data.pop(0)
+        store.sync({"1": None})
+
+        reloaded = Store[list](self.file, [], key="id", database=database)
+        self.assertEqual(reloaded.data, [{"id": "2", "instructor": 2}])
+        self.assertFalse(os.path.exists(self.file))
+
+    def test_database_table_named_after_path_under_root(self):
+        database = os.path.join(self.directory.name, "store.db")
+        Store[dict](os.path.join(self.directory.name, "guilds", "5", "timmie.json"), {}, database=database,
+                    root=self.directory.name).close()
+        connection = sqlite3.connect(database)
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        connection.close()
+        self.assertEqual(tables, ["guilds_5_timmie"])
+
+    def test_database_close(self):
+        store = Store[dict](self.file, {}, database=os.path.join(self.directory.name, "store.db"))
+        store.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            store.sync({"1": 1})
+
+    def test_database_migrates_json(self):
+        store = Store[dict](self.file, {}, journal=True)
+        store.data["1"] = {"timezone": "Europe/Amsterdam"}
+        store.sync()
+        store.data["2"] = {"locale": "NL"}
+        store.sync({"2": store.data["2"]})
+
+        database = os.path.join(self.directory.name, "store.db")
+        migrated = Store[dict](self.file, {}, database=database)
+        self.assertEqual(migrated.data, {"1": {"timezone": "Europe/Amsterdam"}, "2": {"locale": "NL"}})
+        self.assertTrue(os.path.exists(f"{self.file}.migrated"))
+        self.assertEqual(Store[dict](self.file, {}, database=database).data, migrated.data)
+
+    def test_records_round_trip(self):
+        database = os.path.join(self.directory.name, "store.db")
+        for number, options in enumerate(({}, {"journal": True}, {"database": database})):
+            file = os.path.join(self.directory.name, f"timeslots{number}.json")
+            store = Store[list](file, [], key="id", encode=Timeslot.to_json, decode=Timeslot.from_json, **options)
+            store.data = [Timeslot("1", 1000.0, 10), Timeslot("2", 2000.0, "20", Booking("30", "got"))]
+            store.sync()
+            store.data[0].booking = Booking(40, "got", "meta")
+            store.sync({"1": store.data[0]})
+
+            reloaded = Store[list](file, [], key="id", encode=Timeslot.to_json, decode=Timeslot.from_json, **options)
+            self.assertEqual(reloaded.data, [Timeslot("1", 1000.0, 10, Booking(40, "got", "meta")), Timeslot("2", 2000.0, 20, Booking(30, "got"))])
+
+    def test_key_type(self):
+        store = Store[dict](self.file, {}, journal=True, key_type=int)
+        store.data[1] = [2]
+        store.sync({1: store.data[1]})
+        self.assertEqual(Store[dict](self.file, {}, journal=True, key_type=int).data, {1: [2]})
+
+    def test_shared_refresh_on_change(self):
+        first = Store[dict](self.file, {}, shared=True)
+        second = Store[dict](self.file, {}, shared=True)
+        self.assertFalse(second.refresh())
+        first.data["1"] = "a"
+        first.sync({"1": "a"})
+        self.assertTrue(second.refresh())
+        self.assertEqual(second.data, {"1": "a"})
+        self.assertFalse(second.refresh())
+
+    def test_shared_merges(self):
+        for journal in (False, True):
+            file = os.path.join(self.directory.name, f"merge{journal}.json")
+            reloads = []
+            first = Store[list](file, [], key="id", shared=True, journal=journal)
+            second = Store[list](file, [], key="id", shared=True, journal=journal, on_reload=lambda: reloads.append(True))
+            first.data.append({"id": "1"})
+            first.sync({"1": first.data[-1]})
+            second.data.append({"id": "2"})
+            second.sync({"2": second.data[-1]})
+            self.assertEqual(second.data, [{"id": "1"}, {"id": "2"}])
+            self.assertEqual(reloads, [True])
+            self.assertEqual(Store[list](file, [], key="id", journal=journal).data, [{"id": "1"}, {"id": "2"}])
+
+    def test_shared_conflict(self):
+        first = Store[dict](self.file, {}, shared=True)
+        first.data["1"] = {"booking": None}
+        first.sync({"1": first.data["1"]})
+        second = Store[dict](self.file, {}, shared=True)
+
+        first.data["1"] = {"booking": 10}
+        first.sync({"1": first.data["1"]})
+        second.data["1"] = {"booking": 20}
+        with self.assertRaises(StoreConflict) as conflict:
+            second.sync({"1": second.data["1"]})
+        self.assertEqual(conflict.exception.keys, ["1"])
+        self.assertEqual(second.data, {"1": {"booking": 10}})
+        with open(self.file) as file:
+            self.assertEqual(json.load(file), {"1": {"booking": 10}})
+
+    def test_shared_database_conflict(self):
+        database = os.path.join(self.directory.name, "store.db")
+        first = Store[dict](self.file, {}, shared=True, database=database)
+        first.data["1"] = [1]
+        first.sync({"1": first.data["1"]})
+        second = Store[dict](self.file, {}, shared=True, database=database)
+
+        first.data["1"] = [1, 10]
+        first.sync({"1": first.data["1"]})
+        second.data["1"] = [1, 20]
+        with self.assertRaises(StoreConflict) as conflict:
+            second.sync({"1": second.data["1"]})
+        self.assertEqual(conflict.exception.keys, ["1"])
+        self.assertEqual(second.data, {"1": [1, 10]})
+
+        # A full sync only writes what changed since it last looked, other keys are left alone
+        first.data["2"] = [2]
+        first.sync({"2": first.data["2"]})
+        second.data["3"] = [3]
+        second.sync()
+        self.assertEqual(Store[dict](self.file, {}, database=database).data, {"1": [1, 10], "2": [2], "3": [3]})
+
+    def test_shared_database_claim(self):
+        database = os.path.join(self.directory.name, "store.db")
+        first = Store[dict](self.file, {}, shared=True, database=database)
+        first.data["1"] = {"time": 1000}
+        first.sync({"1": first.data["1"]})
+        second = Store[dict](self.file, {}, shared=True, database=database)
+
+        first.data["1"] = {"time": 1000, "booking": {"user_id": 10}}
+        first.claim({"1": first.data["1"]}, unset="booking")
+        second.data["1"] = {"time": 1000, "booking": {"user_id": 20}}
+        with self.assertRaises(StoreConflict):
+            second.claim({"1": second.data["1"]}, unset="booking")
+        self.assertEqual(second.data, {"1": {"time": 1000, "booking": {"user_id": 10}}})
+        self.assertEqual(Store[dict](self.file, {}, database=database).data, second.data)
+
+    def test_shared_locked_starts_from_latest(self):
+        first = Store[dict](self.file, {}, shared=True)
+        second = Store[dict](self.file, {}, shared=True)
+        first.data["1"] = [1]
+        first.sync({"1": first.data["1"]})
+        with second.locked():
+            self.assertEqual(second.data, {"1": [1]})
+            second.data["1"].append(2)
+            second.sync({"1": second.data["1"]})
+        self.assertTrue(first.refresh())
+        self.assertEqual(first.data, {"1": [1, 2]})
+
+if __name__ == "__main__":
+    unittest.main()
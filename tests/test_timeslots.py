@@ -1,5 +1,7 @@
 import unittest
 from unittest.mock import MagicMock
+from bookingbot.records import Booking, Timeslot
+from bookingbot.store import StoreConflict
 from bookingbot.timeslots import Timeslots
 import time
 
@@ -9,67 +11,239 @@ class TimeslotsTests(unittest.TestCase):
         self.timeslots = Timeslots(self.timmies)
         self.timeslots.timeslots = MagicMock()
         self.timeslots.timeslots.data = []
+        self.timeslots.archive = MagicMock()
         self.future_time = int(time.time()) + 3600
         self.past_time = int(time.time()) - 3600
 
     def test_add_timeslot(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+        timeslot = Timeslot("1", self.future_time, 1234567890)
         self.timeslots.add(timeslot)
         self.assertEqual(len(self.timeslots.timeslots.data), 1)
         self.timeslots.timeslots.sync.assert_called_once()
 
     def test_list_timeslots(self):
-        timeslot1 = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
-        timeslot2 = {"id": "2", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+        timeslot1 = Timeslot("1", self.future_time, 1234567890)
+        timeslot2 = Timeslot("2", self.future_time, 1234567890)
         self.timeslots.add(timeslot1)
         self.timeslots.add(timeslot2)
         timeslots = self.timeslots.list()
         self.assertEqual(len(timeslots), 2)
 
     def test_remove_timeslot(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+        timeslot = Timeslot("1", self.future_time, 1234567890)
         self.timeslots.add(timeslot)
         self.timeslots.timeslots.sync.reset_mock()
         self.timeslots.remove("1")
         self.assertEqual(len(self.timeslots.timeslots.data), 0)
         self.timeslots.timeslots.sync.assert_called_once()
 
+    def test_ids_are_unique(self):
+        self.timeslots.add(Timeslot("1", self.future_time, 1234567890))
+        with self.assertRaises(ValueError):
+            self.timeslots.add(Timeslot("1", self.future_time + 60, 1234567890))
+        added = self.timeslots.add_many([Timeslot("1", self.future_time + 60, 1234567890), Timeslot("2", self.future_time + 60, 1234567890)])
+        self.assertEqual([timeslot.id for timeslot in added], ["2"])
+
+        self.assertFalse(self.timeslots.ids.is_free("1"))
+        self.timeslots.remove("1")
+        # Removed IDs are held back for a while
+        self.assertFalse(self.timeslots.ids.is_free("1"))
+        self.assertTrue(self.timeslots.ids.is_free("1", time.time() + self.timeslots.ids.grace + 1))
+
     def test_has_booking(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {"user_id": "1234567890"}}
+        timeslot = Timeslot("1", self.future_time, 1234567890, Booking(1234567890))
         self.timeslots.add(timeslot)
-        self.assertTrue(self.timeslots.has_booking("1234567890"))
-        self.assertFalse(self.timeslots.has_booking("9876543210"))
+        self.assertTrue(self.timeslots.has_booking(1234567890))
+        self.assertFalse(self.timeslots.has_booking(9876543210))
+
+    def test_expired_booking_does_not_count(self):
+        self.timeslots.add(Timeslot("1", self.past_time, 1234567890, Booking(111)))
+        self.assertFalse(self.timeslots.has_booking(111))
 
     def test_is_available(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+        timeslot = Timeslot("1", self.future_time, 1234567890)
         self.timeslots.add(timeslot)
         self.assertTrue(self.timeslots.is_available("1"))
         self.assertFalse(self.timeslots.is_available("2"))
 
     def test_book_timeslot(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
-        booking_data = {"user_id": "1234567890", "meta_username": "meta", "got_username": "got"}
+        timeslot = Timeslot("1", self.future_time, 1234567890)
+        booking_data = Booking(1234567890, "got", "meta")
         self.timeslots.add(timeslot)
         self.timeslots.book("1", booking_data)
-        self.assertEqual(self.timeslots.timeslots.data[0]["booking"], booking_data)
+        self.assertEqual(self.timeslots.timeslots.data[0].booking, booking_data)
 
     def test_exists_timeslot(self):
-        timeslot = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+        timeslot = Timeslot("1", self.future_time, 1234567890)
         self.timeslots.add(timeslot)
         self.assertTrue(self.timeslots.exists("1"))
         self.assertFalse(self.timeslots.exists("2"))
         
-    def test_cleanup_timeslots(self):
-        timeslot1 = {"id": "1", "time": self.future_time, "instructor": "1234567890", "booking": {}}
-        timeslot2 = {"id": "2", "time": self.future_time, "instructor": "1234567890", "booking": {}}
-        timeslot3 = {"id": "3", "time": self.future_time, "instructor": "1234567890", "booking": {}}
+    def test_expire_timeslots(self):
+        timeslot1 = Timeslot("1", self.future_time, 1234567890)
+        timeslot2 = Timeslot("2", self.past_time, 1234567890)
+        timeslot3 = Timeslot("3", self.past_time, 1234567890)
         self.timeslots.add(timeslot1)
         self.timeslots.add(timeslot2)
-        self.assertEqual(len(self.timeslots.timeslots.data), 2)
-        self.timeslots.timeslots.data[0]["time"] = self.past_time
         self.timeslots.add(timeslot3)
+        self.timeslots.remove("3")
         self.assertEqual(len(self.timeslots.timeslots.data), 2)
-        self.timeslots.timeslots.sync.assert_called()
+        # Expired timeslots are not listed, even before they are evicted
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list()], ["1"])
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list(1234567890)], ["1"])
+        self.assertFalse(self.timeslots.is_available("2"))
+
+        self.timeslots.timeslots.sync.reset_mock()
+        expired = self.timeslots.expire()
+        self.assertEqual([timeslot.id for timeslot in expired], ["2"])
+        self.assertEqual(len(self.timeslots.timeslots.data), 1)
+        self.timeslots.timeslots.sync.assert_called_once_with({"2": None})
+        self.timeslots.archive.append.assert_called_once_with(expired)
+        self.assertEqual(self.timeslots.next_expiry(), self.future_time + Timeslots.expire_after)
+
+    def test_expire_nothing_due(self):
+        self.assertIsNone(self.timeslots.next_expiry())
+        self.assertEqual(self.timeslots.expire(), [])
+        self.timeslots.timeslots.sync.assert_not_called()
+
+    def test_list_sorted_by_time(self):
+        timeslot1 = Timeslot("1", self.future_time + 60, 1234567890)
+        timeslot2 = Timeslot("2", self.future_time, 1234567890)
+        timeslot3 = Timeslot("3", self.future_time + 30, 9876543210)
+        self.timeslots.add(timeslot1)
+        self.timeslots.add(timeslot2)
+        self.timeslots.add(timeslot3)
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list()], ["2", "3", "1"])
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list(1234567890)], ["2", "1"])
+
+    def test_list_unbooked_for_timmie(self):
+        self.timmies.list_instructors.return_value = [1234567890]
+        timeslot1 = Timeslot("1", self.future_time, 1234567890)
+        timeslot2 = Timeslot("2", self.future_time, 1234567890, Booking(1))
+        timeslot3 = Timeslot("3", self.future_time, 9876543210)
+        self.timeslots.add(timeslot1)
+        self.timeslots.add(timeslot2)
+        self.timeslots.add(timeslot3)
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list_unbooked_for_timmie(1)], ["1"])
+
+    def test_indexes_follow_book_and_remove(self):
+        timeslot = Timeslot("1", self.future_time, 1234567890)
+        booking_data = Booking(555, "got", "meta")
+        self.timeslots.add(timeslot)
+        self.assertTrue(self.timeslots.book("1", booking_data))
+        self.assertFalse(self.timeslots.book("1", booking_data))
+        self.assertTrue(self.timeslots.has_booking(555))
+        self.timeslots.remove("1")
+        self.assertFalse(self.timeslots.has_booking(555))
+        self.assertFalse(self.timeslots.exists("1"))
+        self.assertEqual(self.timeslots.list(), [])
+        self.assertEqual(self.timeslots.list(1234567890), [])
+
+    def test_add_many(self):
+        timeslot1 = Timeslot("1", self.future_time, 1234567890)
+        self.timeslots.add(timeslot1)
+        self.timeslots.timeslots.sync.reset_mock()
+        added = self.timeslots.add_many([
+            Timeslot("2", self.future_time, 1234567890),
+            Timeslot("3", self.future_time, 9876543210),
+            Timeslot("4", self.future_time + 60, 1234567890),
+            Timeslot("5", self.future_time + 60, 1234567890),
+        ])
+        self.assertEqual([timeslot.id for timeslot in added], ["3", "4"])
+        self.assertEqual(len(self.timeslots.list()), 3)
+        self.timeslots.timeslots.sync.assert_called_once()
+
+    def test_hold(self):
+        timeslot = Timeslot("1", self.future_time, 1234567890)
+        self.timeslots.add(timeslot)
+        self.assertTrue(self.timeslots.hold("1", 111))
+        self.assertTrue(self.timeslots.is_available("1", 111))
+        self.assertFalse(self.timeslots.is_available("1", 222))
+        self.assertFalse(self.timeslots.hold("1", 222))
+        self.assertFalse(self.timeslots.is_held("1", 111))
+        self.assertTrue(self.timeslots.is_held("1", 222))
+        # Holding it again, like after closing the booking modal, keeps it for the same user
+        self.assertTrue(self.timeslots.hold("1", 111))
+        self.assertFalse(self.timeslots.book("1", Booking(222)))
+        self.assertTrue(self.timeslots.book("1", Booking(111)))
+        self.assertFalse(self.timeslots.is_available("1", 111))
+
+    def test_hold_runs_out(self):
+        timeslot = Timeslot("1", self.future_time, 1234567890)
+        self.timeslots.add(timeslot)
+        self.assertTrue(self.timeslots.hold("1", 111, duration=-1))
+        self.assertTrue(self.timeslots.hold("1", 222))
+        self.assertTrue(self.timeslots.book("1", Booking(222)))
+
+    def test_hold_release(self):
+        self.timmies.list_instructors.return_value = [1234567890]
+        self.timeslots.add(Timeslot("1", self.future_time, 1234567890))
+        self.timeslots.add(Timeslot("2", self.future_time, 1234567890))
+        self.assertTrue(self.timeslots.hold("1", 111))
+        self.assertEqual([timeslot.id for timeslot in self.timeslots.list_unbooked_for_timmie(222)], ["2"])
+        # Holding another timeslot releases the first one
+        self.assertTrue(self.timeslots.hold("2", 111))
+        self.assertTrue(self.timeslots.is_available("1", 222))
+        self.timeslots.release(111)
+        self.assertTrue(self.timeslots.is_available("2", 222))
+
+    def test_one_booking_per_user(self):
+        self.timeslots.add(Timeslot("1", self.future_time, 1234567890))
+        self.timeslots.add(Timeslot("2", self.future_time, 1234567890))
+        self.assertTrue(self.timeslots.book("1", Booking(111)))
+        self.assertFalse(self.timeslots.hold("2", 111))
+        self.assertFalse(self.timeslots.book("2", Booking(111)))
+        self.assertTrue(self.timeslots.is_available("2"))
+
+    def test_book_conflict(self):
+        self.timeslots.add(Timeslot("1", self.future_time, 1234567890))
+        self.timeslots.timeslots.claim.side_effect = StoreConflict("timeslots.json", ["1"])
+        self.assertFalse(self.timeslots.book("1", Booking(111)))
+        self.timmies.clear.assert_not_called()
+
+    def test_book_when_clearing_timmie_conflicts(self):
+        self.timeslots.add(Timeslot("1", self.future_time, 1234567890))
+        self.timmies.clear.side_effect = StoreConflict("timmie.json", ["111"])
+        with self.assertLogs("bookingbot.timeslots", "WARNING"):
+            self.assertEqual(self.timeslots.book("1", Booking(111)).id, "1")
+        self.assertTrue(self.timeslots.has_booking(111))
+
+    def test_available(self):
+        self.timmies.list_instructors.return_value = {1234567890, 9876543210}
+        for number in range(6):
+            instructor = 1234567890 if number % 2 else 9876543210
+            self.timeslots.add(Timeslot(str(number), self.future_time + number * 60, instructor))
+        self.timeslots.add(Timeslot("7", self.future_time, 5555555555))
+        self.timeslots.add(Timeslot("8", self.past_time, 1234567890))
+
+        def ids(timeslots):
+            return [timeslot.id for timeslot in timeslots]
+
+        self.assertEqual(ids(self.timeslots.available(1)), ["0", "1", "2", "3", "4", "5"])
+        self.assertEqual(ids(self.timeslots.available(1, limit=2)), ["0", "1"])
+        self.assertEqual(ids(self.timeslots.available(1, start=self.future_time + 60, end=self.future_time + 240)), ["1", "2", "3"])
+        self.assertEqual(ids(self.timeslots.available(1, instructor=1234567890)), ["1", "3", "5"])
+        self.assertEqual(ids(self.timeslots.available(1, instructor=5555555555)), [])
+
+        # Booked and held timeslots are skipped, also when that happens after the query was made
+        available = self.timeslots.available(1)
+        self.assertTrue(self.timeslots.hold("2", 222))
+        self.assertTrue(self.timeslots.book("3", Booking(333)))
+        self.assertEqual(ids(available), ["0", "1", "4", "5"])
+
+    def test_available_while_booking(self):
+        self.timmies.list_instructors.return_value = {1234567890}
+        for number in range(6):
+            self.timeslots.add(Timeslot(str(number), self.future_time + number * 60, 1234567890))
+
+        # Like reading the next page after the timeslots of the first one were booked
+        available = self.timeslots.available(1)
+        self.assertEqual([next(available).id, next(available).id], ["0", "1"])
+        self.assertTrue(self.timeslots.book("0", Booking(100)))
+        self.assertTrue(self.timeslots.book("1", Booking(101)))
+        self.assertTrue(self.timeslots.book("3", Booking(103)))
+        self.timeslots.add(Timeslot("6", self.future_time + 150, 1234567890))
+        self.assertEqual([timeslot.id for timeslot in available], ["2", "6", "4", "5"])
 
 if __name__ == "__main__":
     unittest.main()
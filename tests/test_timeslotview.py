@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from bookingbot.timeslotview import TimeslotView
+
+class TimeslotViewTests(unittest.IsolatedAsyncioTestCase):
+    def timeslots(self, count):
+        return [{"id": str(number), "time": number, "instructor": "1"} for number in range(count)]
+
+    async def test_empty(self):
+        view = TimeslotView("Timeslots:", [], lambda timeslot: timeslot["id"])
+        self.assertTrue(view.empty)
+        self.assertFalse(view.paginated)
+
+    async def test_single_page(self):
+        view = TimeslotView("Timeslots:", self.timeslots(3), lambda timeslot: f"- {timeslot['id']}")
+        self.assertFalse(view.paginated)
+        self.assertEqual(view.content, "Timeslots:\n- 0\n- 1\n- 2\n")
+
+    async def test_renders_lazily(self):
+        render = MagicMock(side_effect=lambda timeslot: "x" * 9)
+        view = TimeslotView("Timeslots:", self.timeslots(100), render, page_length=20)
+        self.assertTrue(view.paginated)
+        self.assertEqual(view.content, "Timeslots: (page 1)\nxxxxxxxxx\nxxxxxxxxx\n")
+        # The lines of the first page plus the one line looked ahead
+        self.assertEqual(render.call_count, 3)
+        self.assertTrue(view.previous.disabled)
+        self.assertFalse(view.next.disabled)
+
+    async def test_buttons(self):
+        view = TimeslotView("Timeslots:", self.timeslots(3), lambda timeslot: timeslot["id"] * 9, page_length=20)
+        interaction = MagicMock()
+        interaction.response.edit_message = AsyncMock()
+
+        await view.next.callback(interaction)
+        self.assertEqual(view.content, "Timeslots: (page 2)\n222222222\n")
+        self.assertTrue(view.next.disabled)
+        self.assertFalse(view.previous.disabled)
+        interaction.response.edit_message.assert_awaited_with(content=view.content, view=view)
+
+        await view.previous.callback(interaction)
+        self.assertEqual(view.content, "Timeslots: (page 1)\n000000000\n111111111\n")
+        self.assertTrue(view.previous.disabled)
+
+if __name__ == "__main__":
+    unittest.main()
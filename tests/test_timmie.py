@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import MagicMock
+from bookingbot.timmie import Timmie
+
+class TimmieTests(unittest.TestCase):
+    def setUp(self):
+        self.timmie = Timmie()
+        self.timmie.timmies = MagicMock()
+        self.timmie.timmies.data = {}
+
+    def test_add(self):
+        self.timmie.add(1, 10)
+        self.timmie.add(1, 11)
+        self.timmie.add(2, 10)
+        self.assertEqual(self.timmie.list_instructors(1), {10, 11})
+        self.assertEqual(self.timmie.list_timmies(10), {1, 2})
+        self.assertEqual(self.timmie.timmies.data, {1: [10, 11], 2: [10]})
+
+    def test_add_twice_syncs_once(self):
+        self.timmie.add(1, 10)
+        self.timmie.add(1, 10)
+        self.timmie.timmies.sync.assert_called_once_with({1: [10]})
+
+    def test_add_many_syncs_once(self):
+        self.timmie.add(1, 10)
+        self.assertEqual(self.timmie.add_many([(1, 10), (1, 11), (2, 10), (2, 10)]), 2)
+        self.assertEqual(self.timmie.timmies.data, {1: [10, 11], 2: [10]})
+        self.assertEqual(self.timmie.list_timmies(10), {1, 2})
+        self.timmie.timmies.sync.assert_called_with({1: [10, 11], 2: [10]})
+        self.assertEqual(self.timmie.timmies.sync.call_count, 2)
+
+    def test_remove(self):
+        self.timmie.add(1, 10)
+        self.timmie.add(1, 11)
+        self.timmie.remove(1, 10)
+        self.assertEqual(self.timmie.list_instructors(1), {11})
+        self.assertEqual(self.timmie.list_timmies(10), set())
+        self.assertEqual(self.timmie.timmies.data, {1: [11]})
+
+    def test_clear(self):
+        self.timmie.add(1, 10)
+        self.timmie.add(1, 11)
+        self.timmie.clear(1)
+        self.assertEqual(self.timmie.list_instructors(1), set())
+        self.assertEqual(self.timmie.list_timmies(11), set())
+        self.assertEqual(self.timmie.timmies.data, {})
+        self.timmie.timmies.sync.assert_called_with({1: None})
+
+if __name__ == "__main__":
+    unittest.main()